@@ -0,0 +1,133 @@
+# Đường dẫn: cotienbot/benchmarks/ann_bench.py
+# Tên file: ann_bench.py
+"""So sánh recall@k và độ trễ truy vấn của IVF với quét chính xác.
+
+Chạy: python benchmarks/ann_bench.py [--sizes 1000 10000 100000] [--nprobe 4 8 16] [--output ann.json]
+                                     [--corpus hard|clustered|text] [--texts cau_hoi.txt]
+- hard (mặc định): các cụm chồng lấn, kích thước lệch nhau; láng giềng gần thường nằm ở cụm bên cạnh
+  nên recall thay đổi rõ theo nprobe.
+- clustered: các cụm tách biệt, dễ (recall gần như luôn bằng 1), chỉ để đo độ trễ.
+- text: nhúng thật các dòng của --texts bằng EMBEDDING_MODEL (cần sentence-transformers); câu hỏi
+  là các dòng không nằm trong chỉ mục. Nên dùng để chỉnh INDEX_ANN_NPROBE.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.ann import BruteForceIndex, IVFIndex  # noqa: E402
+
+
+def _synthetic(n, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _hard(n, dim, clusters, rng):
+    # Tâm cụm nằm trong không gian con ít chiều, nhiễu lớn hơn khoảng cách giữa các tâm,
+    # kích thước cụm theo phân phối lệch (vài chủ đề chiếm phần lớn dữ liệu)
+    basis = rng.standard_normal((32, dim)).astype(np.float32)
+    centers = rng.standard_normal((clusters, 32)).astype(np.float32) @ basis / np.sqrt(32)
+    weights = 1.0 / np.arange(1, clusters + 1)
+    labels = rng.choice(clusters, n, p=weights / weights.sum())
+    return centers[labels] + 1.2 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _corpus(kind, n, dim, queries, rng, lines):
+    """Trả về (dữ liệu, câu hỏi) cho một kích thước chỉ mục."""
+    if kind == "text":
+        from modules.embedder import encode_many
+        if len(lines) < n + queries:
+            raise SystemExit(f"--texts cần ít nhất {n + queries} dòng cho kích thước {n}")
+        chosen = rng.choice(len(lines), n + queries, replace=False)
+        vectors = np.asarray(encode_many([lines[i] for i in chosen]), dtype=np.float32)
+        return vectors[:n], vectors[n:]
+    make = _hard if kind == "hard" else _synthetic
+    data = make(n, dim, max(8, n // 100), rng)
+    noise = 0.3 * rng.standard_normal((queries, dim)).astype(np.float32)
+    return data, data[rng.choice(n, queries, replace=False)] + noise
+
+
+def _percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def _measure(index, queries, k):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        ids, _ = index.search(query, k)
+        latencies.append(time.perf_counter() - started)
+        results.append(ids)
+    return latencies, results
+
+
+def run(sizes, dim, k, queries, nprobes, seed, corpus="hard", lines=()):
+    rng = np.random.default_rng(seed)
+    report = []
+    for n in sizes:
+        data, query_vectors = _corpus(corpus, n, dim, queries, rng, lines)
+
+        exact = BruteForceIndex()
+        exact.add(data)
+        exact_latency, truth = _measure(exact, query_vectors, k)
+        row = {
+            "size": n,
+            "corpus": corpus,
+            "exact": {"p50_ms": _percentile_ms(exact_latency, 50), "p95_ms": _percentile_ms(exact_latency, 95)},
+            "ivf": [],
+        }
+
+        started = time.perf_counter()
+        ivf = IVFIndex(min_size=0)
+        ivf.add(data)
+        build_s = time.perf_counter() - started
+        for nprobe in nprobes:
+            ivf.nprobe = nprobe
+            latency, found = _measure(ivf, query_vectors, k)
+            recall = np.mean([len(set(a.tolist()) & set(b.tolist())) / k for a, b in zip(truth, found)])
+            row["ivf"].append({
+                "nprobe": nprobe,
+                "nlist": len(ivf.centroids),
+                "build_s": build_s,
+                "recall_at_k": float(recall),
+                "p50_ms": _percentile_ms(latency, 50),
+                "p95_ms": _percentile_ms(latency, 95),
+            })
+        report.append(row)
+        print(json.dumps(row), flush=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", choices=["hard", "clustered", "text"], default="hard")
+    parser.add_argument("--texts", help="file văn bản, mỗi dòng một bản ghi (dùng với --corpus text)")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    if args.corpus == "text" and not args.texts:
+        parser.error("--corpus text cần --texts")
+
+    lines = []
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            lines = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+    report = run(args.sizes, args.dim, args.k, args.queries, args.nprobe, args.seed, args.corpus, lines)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "dim": args.dim, "corpus": args.corpus, "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
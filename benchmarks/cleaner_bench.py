@@ -0,0 +1,98 @@
+# Đường dẫn: cotienbot/benchmarks/cleaner_bench.py
+# Tên file: cleaner_bench.py
+"""So sánh thời gian chạy của clean_input cũ (3 lần re.sub) với bản biên dịch sẵn và bản streaming.
+
+Chạy: python benchmarks/cleaner_bench.py [--messages 20000] [--pages 20] [--repeat 5] [--output cleaner.json]
+Bộ dữ liệu tổng hợp: tin nhắn ngắn tiếng Việt có emoji và trang dài (~200KB) như khi /train url=.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cleaner import clean_input, clean_stream  # noqa: E402
+
+_WORDS = ["xin", "chào", "bạn", "Đơn", "hàng", "DH1024", "giao", "tại", "Hà", "Nội", "ngày", "15/08",
+          "giá", "250.000đ", "bảo", "hành", "12", "tháng", "Nguyễn", "Văn", "An", "hỏi", "gì?", "ok!"]
+_NOISE = ["😀", "🔥", "👍", "***", "#", "@", "—", "\t", "\n", "  ", "(", ")", "\"", ":)"]
+
+
+def legacy_clean_input(text):
+    """Bản clean_input trước đây, giữ lại làm chuẩn so sánh."""
+    if not text:
+        return ""
+    text = re.sub(r"[^\w\s.,!?]", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.lower()
+
+
+def _text(rng, words):
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(_WORDS))
+        parts.append(rng.choice(_NOISE) if rng.random() < 0.15 else " ")
+    # Chuẩn NFC để so sánh kết quả với bản cũ (bản cũ không chuẩn hóa dấu tổ hợp)
+    return unicodedata.normalize("NFC", "".join(parts))
+
+
+def _time(fn, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _stream(text, chunk=8192):
+    return "".join(clean_stream(text[i:i + chunk] for i in range(0, len(text), chunk)))
+
+
+def run(messages, pages, repeat, seed):
+    rng = random.Random(seed)
+    corpora = {
+        "messages": [_text(rng, rng.randint(3, 40)) for _ in range(messages)],
+        "pages": [_text(rng, 30000) for _ in range(pages)],
+    }
+    variants = {"legacy": legacy_clean_input, "clean_input": clean_input, "clean_stream": _stream}
+    report = []
+    for name, corpus in corpora.items():
+        expected = [legacy_clean_input(text) for text in corpus]
+        row = {"corpus": name, "items": len(corpus), "chars": sum(map(len, corpus)), "variants": []}
+        for variant, fn in variants.items():
+            if variant == "clean_stream" and name == "messages":
+                continue  # Streaming chỉ dành cho văn bản lớn
+            if [fn(text) for text in corpus] != expected:
+                raise SystemExit(f"{variant} cho kết quả khác bản cũ trên bộ {name}")
+            seconds = _time(fn, corpus, repeat)
+            row["variants"].append({"name": variant, "seconds": seconds, "mb_per_s": row["chars"] / seconds / 1e6})
+        report.append(row)
+        print(json.dumps(row), flush=True)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    report = run(args.messages, args.pages, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "results": report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
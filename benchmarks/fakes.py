@@ -0,0 +1,231 @@
+# Đường dẫn: cotienbot/benchmarks/fakes.py
+# Tên file: fakes.py
+"""Bản giả lập trong bộ nhớ của Firestore và telegram.Bot cho benchmark (không gọi dịch vụ thật).
+
+Chỉ hỗ trợ phần API mà bot đang dùng; có thể thêm độ trễ mỗi thao tác để giống mạng thật.
+"""
+import time
+import uuid
+import types
+import threading
+from datetime import datetime, timezone
+
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+
+
+def _resolve(data, current=None):
+    result = dict(current or {})
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            result.pop(key, None)
+        elif value is SERVER_TIMESTAMP:
+            result[key] = datetime.now(timezone.utc)
+        else:
+            result[key] = value
+    return result
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+        self._parent = path.rsplit("/", 1)[0]
+
+    def collection(self, name):
+        return FakeCollection(self._client, f"{self.path}/{name}")
+
+    def get(self):
+        return self._client._read(lambda: FakeSnapshot(self, self._client._docs(self._parent).get(self.id)))
+
+    def set(self, data, merge=False):
+        def write():
+            docs = self._client._docs(self._parent)
+            docs[self.id] = _resolve(data, docs.get(self.id) if merge else None)
+        self._client._write(write)
+
+    def update(self, data):
+        self.set(data, merge=True)
+
+    def create(self, data):
+        def write():
+            docs = self._client._docs(self._parent)
+            if self.id in docs:
+                from google.api_core.exceptions import AlreadyExists
+                raise AlreadyExists(self.path)
+            docs[self.id] = _resolve(data)
+        self._client._write(write)
+
+    def delete(self):
+        self._client._write(lambda: self._client._docs(self._parent).pop(self.id, None))
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=()):
+        self._collection = collection
+        self._filters = list(filters)
+
+    def where(self, field, op, value):
+        if op != "==":
+            raise NotImplementedError(f"FakeQuery chỉ hỗ trợ '==', không hỗ trợ {op!r}")
+        return FakeQuery(self._collection, self._filters + [(field, value)])
+
+    def select(self, fields):
+        return self
+
+    def stream(self):
+        client = self._collection._client
+
+        def read():
+            docs = client._docs(self._collection.path)
+            return [
+                FakeSnapshot(self._collection.document(doc_id), dict(data))
+                for doc_id, data in list(docs.items())
+                if all(data.get(field) == value for field, value in self._filters)
+            ]
+        return iter(client._read(read))
+
+    def count(self):
+        query = self
+
+        class _Count:
+            def get(self):
+                return [[types.SimpleNamespace(value=len(list(query.stream())))]]
+        return _Count()
+
+    def on_snapshot(self, callback):
+        # auth.start_auth_cache sẽ quay về chế độ TTL
+        raise NotImplementedError("FakeFirestore không hỗ trợ snapshot listener")
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        super().__init__(self)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._client, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        doc = self.document()
+        doc.set(data)
+        return datetime.now(timezone.utc), doc
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id in self._client._read(lambda: list(self._client._docs(self.path)))]
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append((reference, data, merge))
+
+    def update(self, reference, data):
+        self._ops.append((reference, data, True))
+
+    def commit(self):
+        def write():
+            for reference, data, merge in self._ops:
+                docs = self._client._docs(reference._parent)
+                docs[reference.id] = _resolve(data, docs.get(reference.id) if merge else None)
+        self._client._write(write)
+        self._ops = []
+
+
+class FakeFirestore:
+    """Firestore trong bộ nhớ; `latency` (giây) được thêm vào mỗi lần đọc/ghi hoặc commit."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._collections = {}
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def _docs(self, path):
+        return self._collections.setdefault(path, {})
+
+    def _read(self, fn):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            return fn()
+
+    def _write(self, fn):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.writes += 1
+            return fn()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+# Thay cho module google.cloud.firestore trong storage/trainer
+firestore_module = types.SimpleNamespace(
+    SERVER_TIMESTAMP=SERVER_TIMESTAMP, DELETE_FIELD=DELETE_FIELD, Client=FakeFirestore,
+)
+
+
+class FakeBot:
+    """telegram.Bot giả: ghi lại thời điểm gửi/sửa tin nhắn, có thể thêm độ trễ mỗi lần gọi."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.sent = []  # (chat_id, thời điểm perf_counter, text)
+        self.edits = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._next_id += 1
+            self.sent.append((chat_id, time.perf_counter(), text))
+            return types.SimpleNamespace(message_id=self._next_id, chat_id=chat_id, text=text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.edits += 1
+
+    def get_file(self, file_id):
+        raise NotImplementedError("FakeBot không hỗ trợ tải file")
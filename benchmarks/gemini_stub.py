@@ -0,0 +1,102 @@
+# Đường dẫn: cotienbot/benchmarks/gemini_stub.py
+# Tên file: gemini_stub.py
+"""Server giả lập Gemini (generateContent và streamGenerateContent?alt=sse) để thử bot không cần API key thật.
+
+Chạy: python benchmarks/gemini_stub.py [--port 8765] [--chunks 8] [--chunk-delay 0.2] [--latency 0.5]
+Rồi đặt GEMINI_URL=http://127.0.0.1:8765/v1beta/models/stub:generateContent và GEMINI_API_KEY bất kỳ.
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _body(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Gán trên lớp con qua make_server
+    chunks = 8
+    chunk_delay = 0.2
+    latency = 0.5
+    status = 200
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        prompt = payload.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+        words = [f"phần{i + 1}" for i in range(self.chunks)]
+        time.sleep(self.latency)
+
+        if self.status != 200:
+            data = json.dumps({"error": {"code": self.status, "message": "stub error"}}).encode()
+            self._send_headers(self.status, "application/json; charset=utf-8", len(data))
+            self.wfile.write(data)
+            return
+
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(self.chunk_delay)
+                self._write_chunk(f"data: {json.dumps(_body(word + ' '), ensure_ascii=False)}\r\n\r\n".encode())
+            self._write_chunk(b"")
+            return
+
+        data = json.dumps(_body(" ".join(words) + f" ({len(prompt)} ký tự)"), ensure_ascii=False).encode()
+        self._send_headers(200, "application/json; charset=utf-8", len(data))
+        self.wfile.write(data)
+
+    def _send_headers(self, status, content_type, length):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def make_server(port=0, chunks=8, chunk_delay=0.2, latency=0.5, status=200):
+    """Tạo server (port=0 chọn cổng trống); trả về (server, URL generateContent)."""
+    handler = type("Handler", (GeminiStubHandler,), {
+        "chunks": chunks, "chunk_delay": chunk_delay, "latency": latency, "status": status,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1beta/models/stub:generateContent"
+    return server, url
+
+
+def start_in_background(**kwargs):
+    server, url = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--chunk-delay", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.5, help="độ trễ trước phần đầu tiên (giây)")
+    parser.add_argument("--status", type=int, default=200, help="mã lỗi HTTP muốn giả lập")
+    args = parser.parse_args()
+
+    server, url = make_server(args.port, args.chunks, args.chunk_delay, args.latency, args.status)
+    print(f"GEMINI_URL={url}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
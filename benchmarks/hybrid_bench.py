@@ -0,0 +1,98 @@
+# Đường dẫn: cotienbot/benchmarks/hybrid_bench.py
+# Tên file: hybrid_bench.py
+"""So sánh chất lượng (hit@k, MRR) và độ trễ giữa truy hồi semantic và hybrid (BM25 + embedding).
+
+Chạy: python benchmarks/hybrid_bench.py [--records 2000] [--queries 200] [--output hybrid.json]
+Cần sentence-transformers (dùng EMBEDDING_MODEL như bot). Bộ dữ liệu tổng hợp gồm các câu
+tiếng Việt chứa tên riêng, mã số và con số, là loại câu hỏi embedding thường trả lời kém.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import retriever  # noqa: E402
+from modules.embedder import encode_many  # noqa: E402
+from modules.index import UserIndex  # noqa: E402
+from utils.cleaner import clean_input  # noqa: E402
+
+_NAMES = ["Nguyễn Văn An", "Trần Thị Bình", "Lê Hoàng Cường", "Phạm Minh Dũng", "Võ Thu Hà", "Đặng Quốc Huy"]
+_CITIES = ["Hà Nội", "Đà Nẵng", "Nha Trang", "Huế", "Cần Thơ", "Hải Phòng"]
+_TEMPLATES = [
+    ("Đơn hàng DH{code} của {name} được giao tại {city} vào ngày {day} tháng {month}.",
+     "đơn DH{code} giao khi nào"),
+    ("Số điện thoại hỗ trợ chi nhánh {city} mã CN{code} là 0{phone}.",
+     "hotline chi nhánh CN{code}"),
+    ("Sản phẩm SP{code} có giá {price} nghìn đồng và bảo hành {month} tháng.",
+     "giá SP{code} bao nhiêu"),
+    ("{name} phụ trách dự án PRJ{code} tại văn phòng {city}.",
+     "ai phụ trách PRJ{code}"),
+]
+
+
+def _corpus(n, queries, rng):
+    records, questions = [], []
+    for i in range(n):
+        text, question = _TEMPLATES[i % len(_TEMPLATES)]
+        values = {
+            "code": 1000 + i, "name": rng.choice(_NAMES), "city": rng.choice(_CITIES),
+            "day": rng.randint(1, 28), "month": rng.randint(1, 12),
+            "phone": rng.randint(100000000, 999999999), "price": rng.randint(50, 5000),
+        }
+        records.append({"content": clean_input(text.format(**values))})
+        questions.append((clean_input(question.format(**values)), i))
+    return records, rng.sample(questions, min(queries, len(questions)))
+
+
+def _evaluate(name, search, questions, k):
+    hits, reciprocal, latencies = 0, 0.0, []
+    for question, expected in questions:
+        started = time.perf_counter()
+        ranked, _ = search(question)
+        latencies.append(time.perf_counter() - started)
+        ids = [i for i, _ in ranked[:k]]
+        if expected in ids:
+            hits += 1
+            reciprocal += 1.0 / (ids.index(expected) + 1)
+    return {
+        "mode": name,
+        f"hit_at_{k}": hits / len(questions),
+        "mrr": reciprocal / len(questions),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    records, questions = _corpus(args.records, args.queries, random.Random(args.seed))
+    index = UserIndex(records, encode_many([record["content"] for record in records]))
+    # Nhúng trước các câu hỏi để so sánh độ trễ truy hồi, không tính thời gian chạy mô hình lần đầu
+    encode_many([question for question, _ in questions])
+
+    results = [
+        _evaluate("semantic", lambda q: (retriever._semantic(index, q, args.k, 0.0), "semantic"), questions, args.k),
+        _evaluate("hybrid", lambda q: retriever._hybrid(index, q, args.k, 0.0), questions, args.k),
+    ]
+    report = {"records": args.records, "queries": len(questions), "k": args.k, "results": results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
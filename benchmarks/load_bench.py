@@ -0,0 +1,306 @@
+# Đường dẫn: cotienbot/benchmarks/load_bench.py
+# Tên file: load_bench.py
+"""Phát lại update Telegram tổng hợp vào Flask app với Firestore, Bot và Gemini giả lập.
+
+Chạy: python benchmarks/load_bench.py [--users 10 100] [--records 100 1000] [--concurrency 1 8]
+                                      [--updates 500] [--output load.json] [--baseline old.json]
+Mỗi kịch bản (tổ hợp users x records x concurrency) chạy trong một tiến trình riêng để đo được
+thời gian khởi động lạnh và bộ nhớ tối đa. Cần sentence-transformers (mô hình nhúng là thật).
+Báo cáo: thông lượng, p50/p95/p99 từng giai đoạn (theo span của utils.tracing), độ trễ trả lời
+webhook, RSS tối đa và thời gian khởi động.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import itertools
+import resource
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+_NAMES = ["Nguyễn Văn An", "Trần Thị Bình", "Lê Hoàng Cường", "Phạm Minh Dũng", "Võ Thu Hà"]
+_CITIES = ["Hà Nội", "Đà Nẵng", "Nha Trang", "Huế", "Cần Thơ"]
+_UNKNOWN = ["thời tiết hôm nay thế nào", "kể cho tôi một câu chuyện vui", "làm sao để học lập trình", "món ăn nào ngon ở miền tây"]
+
+
+def _record_text(code, rng):
+    return (f"Sản phẩm SP{code} do {rng.choice(_NAMES)} phụ trách, giao tại {rng.choice(_CITIES)} "
+            f"với giá {rng.randint(50, 5000)} nghìn đồng và bảo hành {rng.randint(1, 24)} tháng.")
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def _max_rss_mb():
+    # Linux trả về KB, macOS trả về byte
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _configure_env(cfg, gemini_url):
+    env = {
+        "TELEGRAM_TOKEN": "123456:benchmark",
+        "GEMINI_URL": gemini_url,
+        "GEMINI_API_KEY": "benchmark",
+        "GEMINI_STREAM": "1" if cfg["stream"] else "0",
+        "RESPONDER_MODE": cfg["responder_mode"],
+        "UPDATE_WORKERS": str(cfg["workers"]),
+        "UPDATE_QUEUE_SIZE": str(max(100, cfg["updates"])),
+        "DEDUP_BACKEND": "memory",
+        "AUTH_CACHE_MODE": "ttl",
+        "INDEX_SNAPSHOT_DIR": "",
+        "RESPONSE_CACHE_PATH": "",
+        "TRACE_SAMPLE_RATE": "0",
+        "TRACE_SLOW_SECONDS": "1e9",
+        "LOG_SAMPLE_RATE": "0",
+    }
+    if not cfg["telegram_limits"]:
+        # Giới hạn tốc độ gửi của Telegram sẽ che mất chi phí xử lý thật của bot
+        env.update(SEND_GLOBAL_RATE="1e9", SEND_CHAT_RATE="1e9", SEND_CHAT_BURST="1e9")
+    os.environ.update(env)
+
+
+def _install_fakes(cfg):
+    """Thay Firestore client và module firestore bằng bản giả trước khi import main."""
+    from fakes import FakeFirestore, firestore_module
+    from modules import storage, trainer
+    db = FakeFirestore(latency=cfg["firestore_latency_ms"] / 1000)
+    storage._firestore_client = db
+    storage.firestore = firestore_module
+    trainer._import_firestore = lambda: setattr(trainer, "firestore", firestore_module)
+    return db
+
+
+def _seed(db, users, records, rng):
+    """Ghi trực tiếp các bản ghi huấn luyện (kèm embedding) vào Firestore giả; trả về mã sản phẩm theo user."""
+    from modules.embedder import EMBEDDING_MODEL, encode_many
+    from utils.vectors import encode_vector
+    codes = {}
+    for user in users:
+        user_codes = [1000 + i for i in range(records)]
+        texts = [_record_text(code, rng) for code in user_codes]
+        collection = db.collection("users").document(str(user)).collection("trained_data")
+        for start in range(0, len(texts), 500):
+            batch = db.batch()
+            vectors = encode_many(texts[start:start + 500])
+            for text, vector in zip(texts[start:start + 500], vectors):
+                batch.set(collection.document(), {
+                    "content": text, "type": "text", **encode_vector(vector), "embedding_model": EMBEDDING_MODEL,
+                })
+            batch.commit()
+        codes[user] = user_codes
+    return codes
+
+
+def _make_updates(cfg, users, codes, rng):
+    updates, expected = [], 0
+    for i in range(cfg["updates"]):
+        user = users[i % len(users)]
+        roll = rng.random()
+        if roll < cfg["train_ratio"]:
+            text = f"/train text {_record_text(rng.randint(10000, 99999), rng)}"
+        elif roll < cfg["train_ratio"] + cfg["match_ratio"] and codes[user]:
+            text = f"giá SP{rng.choice(codes[user])} bao nhiêu"
+        else:
+            text = f"{rng.choice(_UNKNOWN)} {i}"
+        update = {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1, "date": int(time.time()), "text": text,
+                "chat": {"id": user, "type": "private"},
+                "from": {"id": user, "is_bot": False, "first_name": "bench"},
+            },
+        }
+        updates.append(update)
+        expected += 1
+        if rng.random() < cfg["duplicate_ratio"]:
+            updates.append(update)  # Telegram gửi lại: phải bị loại, không sinh thêm câu trả lời
+    return updates, expected
+
+
+def run_scenario(cfg):
+    """Chạy một kịch bản trong tiến trình hiện tại và trả về kết quả dạng dict."""
+    from gemini_stub import start_in_background
+    rng = random.Random(cfg["seed"])
+    stub, gemini_url = start_in_background(
+        latency=cfg["gemini_latency_ms"] / 1000, chunks=cfg["gemini_chunks"], chunk_delay=cfg["gemini_chunk_delay_ms"] / 1000,
+    )
+    _configure_env(cfg, gemini_url)
+    db = _install_fakes(cfg)
+    users = list(range(1, cfg["users"] + 1))
+    for user in users:
+        db.collection("users").document(str(user)).set({"is_authenticated": True})
+
+    started = time.perf_counter()
+    import main
+    import_seconds = time.perf_counter() - started
+    if not main._ready.wait(600):
+        raise SystemExit("Warm-up không hoàn tất sau 600s")
+    ready_seconds = time.perf_counter() - started
+
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+    from fakes import FakeBot
+    from utils.tracing import add_trace_listener
+    bot = FakeBot(latency=cfg["bot_latency_ms"] / 1000)
+    main.bot = bot
+    main.outbox.bot = bot
+
+    seed_started = time.perf_counter()
+    codes = _seed(db, users, cfg["records"], rng)
+    seed_seconds = time.perf_counter() - seed_started
+    updates, expected = _make_updates(cfg, users, codes, rng)
+
+    stages, totals, outcomes, acks = {}, [], {}, []
+    lock = threading.Lock()
+
+    def on_trace(trace, outcome, total):
+        with lock:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == "ok":
+                totals.append(total)
+            for stage, seconds in trace.spans:
+                stages.setdefault(stage, []).append(seconds)
+
+    add_trace_listener(on_trace)
+    local = threading.local()
+
+    def post(update):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = main.app.test_client()
+        sent_at = time.perf_counter()
+        response = client.post("/webhook", json=update)
+        with lock:
+            acks.append(time.perf_counter() - sent_at)
+        return response.status_code
+
+    replay_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=cfg["concurrency"]) as pool:
+        statuses = list(pool.map(post, updates))
+    deadline = time.monotonic() + cfg["timeout"]
+    while len(bot.sent) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    finished = bot.sent[-1][1] if bot.sent else time.perf_counter()
+    wall = finished - replay_started
+    main.shutdown()
+
+    return {
+        "scenario": {key: cfg[key] for key in ("users", "records", "concurrency", "updates", "workers")},
+        "config": cfg,
+        "cold_start": {"import_s": import_seconds, "ready_s": ready_seconds},
+        "seed_s": seed_seconds,
+        "throughput_per_s": len(bot.sent) / wall if wall > 0 else None,
+        "wall_s": wall,
+        "replies": len(bot.sent),
+        "expected_replies": expected,
+        "edits": bot.edits,
+        "http_status": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        "outcomes": outcomes,
+        "webhook_ack": _percentiles(acks),
+        "update_total": _percentiles(totals),
+        "stages": {stage: _percentiles(samples) for stage, samples in sorted(stages.items())},
+        "firestore": {"reads": db.reads, "writes": db.writes},
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+
+def _run_child(cfg):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", json.dumps(cfg)],
+        stdout=subprocess.PIPE, text=True, timeout=cfg["timeout"] + 900,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Kịch bản {cfg} lỗi (mã {result.returncode})")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _compare(report, baseline):
+    """In thay đổi thông lượng và p95 tổng so với một báo cáo trước đó."""
+    previous = {json.dumps(row["scenario"], sort_keys=True): row for row in baseline.get("results", [])}
+    for row in report["results"]:
+        old = previous.get(json.dumps(row["scenario"], sort_keys=True))
+        if not old or not old.get("update_total") or not row.get("update_total"):
+            continue
+        throughput = (row["throughput_per_s"] / old["throughput_per_s"] - 1) * 100
+        p95 = (row["update_total"]["p95_ms"] / old["update_total"]["p95_ms"] - 1) * 100
+        print(f"{row['scenario']}: throughput {throughput:+.1f}%, p95 {p95:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10])
+    parser.add_argument("--records", type=int, nargs="+", default=[100])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4, help="UPDATE_WORKERS của bot")
+    parser.add_argument("--match-ratio", type=float, default=0.5, help="tỉ lệ câu hỏi có dữ liệu huấn luyện khớp")
+    parser.add_argument("--train-ratio", type=float, default=0.05, help="tỉ lệ lệnh /train text")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.02, help="tỉ lệ update bị gửi lại")
+    parser.add_argument("--responder-mode", default="snippets", choices=["snippets", "grounded"])
+    parser.add_argument("--stream", action="store_true", help="bật GEMINI_STREAM")
+    parser.add_argument("--telegram-limits", action="store_true", help="giữ giới hạn tốc độ gửi mặc định")
+    parser.add_argument("--firestore-latency-ms", type=float, default=5)
+    parser.add_argument("--bot-latency-ms", type=float, default=20)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-chunks", type=int, default=5)
+    parser.add_argument("--gemini-chunk-delay-ms", type=float, default=50)
+    parser.add_argument("--timeout", type=float, default=300, help="thời gian chờ tối đa các câu trả lời (giây)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(json.loads(args.child)), ensure_ascii=False), flush=True)
+        return
+
+    base = {
+        "updates": args.updates, "workers": args.workers, "match_ratio": args.match_ratio,
+        "train_ratio": args.train_ratio, "duplicate_ratio": args.duplicate_ratio,
+        "responder_mode": args.responder_mode, "stream": args.stream, "telegram_limits": args.telegram_limits,
+        "firestore_latency_ms": args.firestore_latency_ms, "bot_latency_ms": args.bot_latency_ms,
+        "gemini_latency_ms": args.gemini_latency_ms, "gemini_chunks": args.gemini_chunks,
+        "gemini_chunk_delay_ms": args.gemini_chunk_delay_ms, "timeout": args.timeout, "seed": args.seed,
+    }
+    results = []
+    for users, records, concurrency in itertools.product(args.users, args.records, args.concurrency):
+        row = _run_child({**base, "users": users, "records": records, "concurrency": concurrency})
+        results.append(row)
+        summary = {k: row[k] for k in ("scenario", "throughput_per_s", "update_total", "max_rss_mb", "cold_start")}
+        print(json.dumps(summary, ensure_ascii=False), flush=True)
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            _compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
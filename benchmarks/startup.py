@@ -0,0 +1,89 @@
+# Đường dẫn: cotienbot/benchmarks/startup.py
+# Tên file: startup.py
+"""Đo thời gian khởi động: import main, /health đầu tiên và thời điểm /ready.
+
+Chạy: python benchmarks/startup.py [--runs 3] [--ready-timeout 120] [--importtime]
+Mỗi lần đo chạy trong một tiến trình Python mới để không dùng lại module đã import.
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter() - t0
+client = main.app.test_client()
+t1 = time.perf_counter()
+status = client.get("/health").status_code
+t_health = time.perf_counter() - t1
+t_ready = None
+deadline = time.perf_counter() + float(sys.argv[1])
+while time.perf_counter() < deadline:
+    if client.get("/ready").status_code == 200:
+        t_ready = time.perf_counter() - t0
+        break
+    time.sleep(0.05)
+print(json.dumps({"import_s": t_import, "first_health_s": t_health, "health_status": status, "ready_s": t_ready}))
+"""
+
+
+def _run_once(ready_timeout, importtime):
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_TOKEN", "123456:benchmark-token")
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", _PROBE, str(ready_timeout)]
+    proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "probe failed")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    if importtime:
+        result["slowest_imports"] = _slowest_imports(proc.stderr)
+    return result
+
+
+def _slowest_imports(stderr, limit=10):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if parts[1].isdigit():
+            rows.append((int(parts[1]), parts[2]))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_us": us} for us, name in rows[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--ready-timeout", type=float, default=120)
+    parser.add_argument("--importtime", action="store_true", help="liệt kê các module import chậm nhất")
+    parser.add_argument("--output", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    runs = [_run_once(args.ready_timeout, args.importtime) for _ in range(args.runs)]
+    summary = {
+        "runs": runs,
+        "import_s_min": min(run["import_s"] for run in runs),
+        "first_health_s_max": max(run["first_health_s"] for run in runs),
+    }
+    ready = [run["ready_s"] for run in runs if run["ready_s"] is not None]
+    summary["ready_s_min"] = min(ready) if ready else None
+
+    text = json.dumps(summary, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
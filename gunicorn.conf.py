@@ -1,4 +1,14 @@
-workers = 1  # Chỉ dùng 1 worker để tiết kiệm RAM
+import os
+
+# Mặc định 1 worker để tiết kiệm RAM; khi tăng cần DEDUP_BACKEND=sqlite hoặc firestore
+# để các worker dùng chung danh sách update đã xử lý
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
 threads = 2  # Sử dụng 2 thread để xử lý đồng thời
 bind = "0.0.0.0:10000"
 timeout = 30
+graceful_timeout = 30  # Thời gian cho worker xử lý nốt hàng đợi update khi nhận SIGTERM
+
+def worker_exit(server, worker):
+    # Gunicorn tự xử lý SIGTERM nên handle_shutdown của main không được gọi
+    from main import shutdown
+    shutdown()
@@ -1,15 +1,28 @@
 from flask import Flask, request
 import telegram
 import os
+import sys
 import logging
 import signal
+import threading
 import requests
-from collections import deque
 from modules.trainer import handle_train
 from modules.retriever import retrieve_data
 from modules.responder import generate_response
-from modules.auth import authenticate_user, check_authentication
+from modules.bulk_import import handle_document
+from modules.auth import authenticate_user, check_authentication, start_auth_cache, stop_auth_cache
+from modules.dispatcher import WorkerPool
+from modules.knowledge import subscribe, unsubscribe, get_subscriptions
+from modules.dedup import update_key, claim_update, release_update
+from modules.poller import Poller
+from modules.sender import Outbox, StreamingReply
+from modules.embedder import is_model_loaded, warm_up
+from modules.response_cache import save_response_cache
+from modules.index import save_index_snapshots
+from modules.storage import _get_firestore_client, is_firestore_ready, flush_chat_history
 from utils.cleaner import clean_input
+from utils.metrics import render_prometheus
+from utils.tracing import span, sampled, start_trace, current_trace, detach_trace, resume_trace, finish_trace
 import time
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -18,8 +31,43 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 bot = telegram.Bot(token=os.getenv("TELEGRAM_TOKEN"))
 
-MAX_PROCESSED = 1000
-processed_messages = deque(maxlen=MAX_PROCESSED)
+# Số giây tối đa một câu hỏi chờ warm-up trước khi trả lời "đang khởi động"
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", 5))
+WARMING_UP_RESPONSE = "Bot đang khởi động, vui lòng thử lại sau giây lát."
+# Tổng thời gian cho mọi bước của shutdown(); phải nhỏ hơn graceful_timeout của gunicorn (30)
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", 25))
+# "webhook" (mặc định) hoặc "polling"; tương đương chạy `python main.py --polling`
+RUN_MODE = os.getenv("RUN_MODE", "webhook")
+
+_ready = threading.Event()
+
+def _warm_up(retry_delay=10):
+    """Nạp mô hình và Firestore client ở nền để /health trả lời ngay khi khởi động."""
+    started = time.monotonic()
+    while not _ready.is_set():
+        if not is_firestore_ready():
+            try:
+                _get_firestore_client()
+                logger.info("Firestore client sẵn sàng")
+                start_auth_cache()
+            except Exception as e:
+                logger.error(f"Warm-up Firestore lỗi: {str(e)}")
+        if not is_model_loaded():
+            try:
+                warm_up()
+                logger.info("Mô hình embedding sẵn sàng")
+            except Exception as e:
+                logger.error(f"Warm-up mô hình lỗi: {str(e)}")
+        if is_model_loaded() and is_firestore_ready():
+            _ready.set()
+            logger.info(f"Warm-up hoàn tất sau {time.monotonic() - started:.2f}s")
+        else:
+            time.sleep(retry_delay)
+
+def start_warm_up():
+    thread = threading.Thread(target=_warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
 
 def set_webhook():
     telegram_token = os.getenv("TELEGRAM_TOKEN")
@@ -48,25 +96,75 @@ def webhook_get():
     logger.info("Webhook GET endpoint called")
     return "Method GET not allowed. Use POST for Telegram webhook.", 405
 
+def dispatch_update(update, timeout=0):
+    """Loại trùng và đưa update vào hàng đợi; dùng chung cho webhook và long polling.
+
+    Trả về False nếu hàng đợi đầy (update chưa được nhận, cần gửi lại sau).
+    """
+    trace = current_trace() or start_trace(None)
+    if not update or not update.message:
+        logger.info("Received empty message")
+        finish_trace("empty")
+        return True
+
+    chat_id = update.message.chat_id
+    message_key = trace.trace_id = update_key(update)
+
+    with span("dedup"):
+        claimed = claim_update(message_key)
+    if not claimed:
+        logger.info("Duplicate message %s, skipping", message_key)
+        finish_trace("duplicate")
+        return True
+
+    # Trace đi cùng update sang worker để tính cả thời gian chờ trong hàng đợi
+    detach_trace()
+    if not update_pool.submit(chat_id, (update, trace, time.perf_counter()), timeout=timeout):
+        release_update(message_key)
+        resume_trace(trace)
+        finish_trace("busy")
+        return False
+    return True
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
+    """Kiểm tra, loại trùng và đưa update vào hàng đợi rồi trả lời Telegram ngay."""
+    start_trace(None)
+    try:
+        with span("parse"):
+            update = telegram.Update.de_json(request.get_json(force=True), bot)
+        if not dispatch_update(update):
+            # Hàng đợi đầy: để Telegram gửi lại sau thay vì làm mất tin nhắn
+            return "Busy", 503
+        return "OK", 200
+
+    except Exception as e:
+        logger.error(f"Webhook error: {str(e)}")
+        finish_trace("error")
+        return "Error", 500
+
+def _process_queued(item):
+    update, trace, queued_at = item
+    resume_trace(trace)
+    trace.add("queue", time.perf_counter() - queued_at)
     try:
-        update = telegram.Update.de_json(request.get_json(force=True), bot)
-        if not update.message:
-            logger.info("Received empty message")
-            return "OK", 200
+        process_update(update)
+    finally:
+        finish_trace()
 
+def process_update(update):
+    """Xử lý một update Telegram (chạy trong worker pool)."""
+    try:
         chat_id = update.message.chat_id
         message_id = update.message.message_id
-        message_key = (chat_id, message_id)
 
-        text = clean_input(update.message.text or "")
-        logger.info(f"Received message from {chat_id}, message_id: {message_id}, text: {text}")
-
-        if message_key in processed_messages:
-            logger.info(f"Duplicate message {message_key}, skipping")
-            return "OK", 200
-        processed_messages.append(message_key)
+        raw_text = update.message.text or ""
+        text = clean_input(raw_text)
+        # clean_input bỏ ký tự "/", khôi phục lại để các lệnh /start, /auth, /subscribe... khớp được
+        if raw_text.lstrip().startswith("/") and not text.startswith("/"):
+            text = "/" + text
+        if sampled():
+            logger.info("Received message chat=%s message_id=%s chars=%d", chat_id, message_id, len(text))
 
         # Lệnh không yêu cầu xác thực
         if text == "/start":
@@ -75,8 +173,8 @@ def webhook():
                 "Sau khi xác thực, dùng /train text=... hoặc /train url=... để huấn luyện bot, "
                 "hoặc gửi câu hỏi bất kỳ để nhận phản hồi."
             )
-            send_with_retry(chat_id, response)
-            return "OK", 200
+            send_reply(chat_id, response)
+            return
 
         if text == "/help":
             response = (
@@ -84,75 +182,155 @@ def webhook():
                 "- /auth <mật_khẩu>: Xác thực để sử dụng bot.\n"
                 "- /train text=...: Huấn luyện bot với văn bản.\n"
                 "- /train url=...: Huấn luyện bot với nội dung từ URL.\n"
+                "- Gửi file .json, .jsonl, .csv hoặc .txt: Huấn luyện bot hàng loạt.\n"
+                "- /subscribe <mã_kho>, /unsubscribe <mã_kho>: Dùng chung một kho kiến thức.\n"
+                "- /kb: Xem các kho kiến thức đã đăng ký.\n"
                 "- Gửi câu hỏi để nhận phản hồi.\n"
                 "Lưu ý: Bạn cần xác thực trước khi sử dụng các lệnh ngoài /start và /help."
             )
-            send_with_retry(chat_id, response)
-            return "OK", 200
+            send_reply(chat_id, response)
+            return
 
         if text.startswith("/auth"):
             parts = text.split(" ", 1)
             if len(parts) < 2:
                 response = "Vui lòng cung cấp mật khẩu: /auth <mật_khẩu>"
-                send_with_retry(chat_id, response)
-                return "OK", 200
+                send_reply(chat_id, response)
+                return
             password = parts[1]
             success, message = authenticate_user(chat_id, password)
-            send_with_retry(chat_id, message)
-            return "OK", 200
+            send_reply(chat_id, message)
+            return
 
         # Kiểm tra xác thực cho các lệnh và câu hỏi khác
-        if not check_authentication(chat_id):
+        with span("auth"):
+            authenticated = check_authentication(chat_id)
+        if not authenticated:
             response = "Bạn cần xác thực trước! Dùng /auth <mật_khẩu>."
-            send_with_retry(chat_id, response)
-            return "OK", 200
+            send_reply(chat_id, response)
+            return
 
         # Xử lý các lệnh và câu hỏi yêu cầu xác thực
+        if text.startswith("/subscribe") or text.startswith("/unsubscribe"):
+            command, _, kb_id = text.partition(" ")
+            kb_id = kb_id.strip()
+            if not kb_id:
+                send_reply(chat_id, f"Vui lòng cung cấp mã kho kiến thức: {command} <mã_kho>")
+                return
+            handler = subscribe if command == "/subscribe" else unsubscribe
+            success, message = handler(chat_id, kb_id)
+            send_reply(chat_id, message)
+            return
+
+        if text == "/kb":
+            kb_ids = get_subscriptions(chat_id)
+            if kb_ids:
+                response = "Kho kiến thức đã đăng ký: " + ", ".join(kb_ids)
+            else:
+                response = "Bạn chưa đăng ký kho kiến thức nào. Dùng /subscribe <mã_kho> để đăng ký."
+            send_reply(chat_id, response)
+            return
+
         if text.lower() in ["hi", "hello", "chào", "xin chào"]:
             response = "Chào bạn! Bạn khỏe không? Gửi câu hỏi hoặc dùng /train để huấn luyện bot nhé!"
-            send_with_retry(chat_id, response)
-            return "OK", 200
-
-        if text.startswith("/train") or text.lower().startswith("train"):
-            text = text.strip()
-            if not text.startswith("/"):
-                text = "/" + text
-            text = text.replace("text ", "text=").replace("url ", "url=")
-            logger.debug(f"Chuẩn hóa lệnh: {text}")
-            response = handle_train(chat_id, text)
+            send_reply(chat_id, response)
+            return
+
+        # Các lệnh cần mô hình: chờ warm-up trong giới hạn rồi báo "đang khởi động"
+        if not _ready.wait(timeout=WARMUP_WAIT_SECONDS):
+            send_reply(chat_id, WARMING_UP_RESPONSE)
+            return
+
+        if update.message.document:
+            response = handle_document(chat_id, bot, update.message.document)
+        elif text.startswith("/train") or text.startswith("train"):
+            # clean_input bỏ ":", "/" và "=" nên URL bị hỏng; handle_train tự làm sạch nội dung
+            response = handle_train(chat_id, raw_text)
         else:
-            data = retrieve_data(chat_id, text)
-            response = generate_response(chat_id, text, data)
+            with span("retrieve"):
+                data = retrieve_data(chat_id, text)
+            # Chỉ được dùng khi GEMINI_STREAM bật và câu trả lời đến từ Gemini
+            reply = StreamingReply(bot, outbox, chat_id)
+            with span("generate"):
+                response = generate_response(chat_id, text, data, on_partial=reply.update)
+            if reply.started:
+                with span("send"):
+                    reply.finish(response)
+                return
 
-        send_with_retry(chat_id, response)
-        return "OK", 200
+        send_reply(chat_id, response)
 
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}")
-        return "Error", 500
+        logger.error(f"Update processing error: {str(e)}", exc_info=True)
 
 @app.route("/health", methods=["GET"])
 def health():
-    logger.info("Health check called")
     return "OK", 200
 
-def send_with_retry(chat_id, text, retries=3, delay=1):
-    for attempt in range(retries):
-        try:
-            bot.send_message(chat_id=chat_id, text=text)
-            return
-        except Exception as e:
-            logger.warning(f"Gửi tin nhắn lỗi (attempt {attempt+1}): {e}")
-            time.sleep(delay)
-    logger.error(f"Thất bại khi gửi tin nhắn sau {retries} lần.")
+@app.route("/ready", methods=["GET"])
+def ready():
+    status = {"model": is_model_loaded(), "firestore": is_firestore_ready()}
+    if _ready.is_set():
+        return {"ready": True, **status}, 200
+    return {"ready": False, **status}, 503
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def send_reply(chat_id, text):
+    """Đưa câu trả lời vào hàng đợi gửi; việc gửi, chia tin dài và thử lại chạy ở nền."""
+    with span("send"):
+        outbox.send(chat_id, text)
+
+def shutdown():
+    """Xử lý nốt các update đang chờ trước khi tiến trình dừng.
+
+    Các bước dùng chung một hạn chót SHUTDOWN_DRAIN_SECONDS; mỗi bước chỉ có phần thời gian còn lại.
+    """
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+
+    def remaining():
+        return max(0, deadline - time.monotonic())
+
+    update_pool.drain(timeout=remaining())
+    outbox.drain(timeout=remaining())
+    stop_auth_cache()
+    save_response_cache()
+    flush_chat_history(timeout=remaining())
+    save_index_snapshots(timeout=remaining())
 
 def handle_shutdown(signum, frame):
     logger.info(f"Received signal {signum}, shutting down")
+    shutdown()
     raise SystemExit
 
+outbox = Outbox(bot)
+update_pool = WorkerPool(
+    _process_queued,
+    workers=int(os.getenv("UPDATE_WORKERS", 4)),
+    queue_size=int(os.getenv("UPDATE_QUEUE_SIZE", 100)),
+    name="updates",
+)
+start_warm_up()
+
+def run_polling():
+    """Chạy bot bằng getUpdates thay cho webhook (không cần URL HTTPS công khai)."""
+    # Chờ đến khi có chỗ trong hàng đợi thay vì trả lời "Busy": offset chưa tăng thì
+    # Telegram vẫn giữ các update phía sau
+    poller = Poller(bot, lambda update: dispatch_update(update, timeout=None))
+    try:
+        poller.run()
+    except SystemExit:
+        poller.stop()
+        raise
+
 if __name__ == "__main__":
     signal.signal(signal.SIGTERM, handle_shutdown)
     signal.signal(signal.SIGINT, handle_shutdown)
+    if "--polling" in sys.argv or RUN_MODE == "polling":
+        run_polling()
+        sys.exit(0)
     set_webhook()
     port = int(os.getenv("PORT", 10000))
     logger.info(f"Starting server on port {port}")
@@ -0,0 +1,237 @@
+# ann.py
+import os
+import json
+import time
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# "exact": quét toàn bộ (mặc định); "ivf": inverted file index xấp xỉ
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "exact")
+# Số cụm được dò khi tìm kiếm (tăng để recall cao hơn, giảm để nhanh hơn)
+INDEX_ANN_NPROBE = int(os.getenv("INDEX_ANN_NPROBE", 8))
+# Số cụm; 0 = tự chọn khoảng sqrt(số vector)
+INDEX_ANN_NLIST = int(os.getenv("INDEX_ANN_NLIST", 0))
+# Dưới ngưỡng này IVF vẫn quét toàn bộ (nhanh hơn và chính xác)
+INDEX_ANN_MIN_SIZE = int(os.getenv("INDEX_ANN_MIN_SIZE", 2000))
+
+
+def normalize(vectors):
+    """Chuẩn hóa L2 từng dòng, trả về ma trận float32 liền khối (luôn là bản sao)."""
+    vectors = np.array(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return vectors
+
+
+def _top_k(ids, scores, k):
+    """Chọn k điểm cao nhất bằng argpartition, chỉ sắp xếp k ứng viên."""
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    candidates = candidates[np.argsort(scores[candidates])[::-1]]
+    return ids[candidates], scores[candidates]
+
+
+class BruteForceIndex:
+    """Tìm kiếm chính xác bằng một phép nhân ma trận-vector; dùng làm chuẩn so sánh."""
+
+    kind = "exact"
+
+    def __init__(self, dim=None):
+        self.dim = dim
+        self.size = 0
+        self._buffer = np.empty((0, dim or 0), dtype=np.float32)
+        # Thông tin đọc từ ann.json khi nạp snapshot
+        self.meta = {}
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+
+    @property
+    def vectors(self):
+        return self._buffer[:self.size]
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= self._buffer.shape[0] and self._buffer.flags.writeable:
+            return
+        # Tăng gấp đôi dung lượng để việc thêm từng vector có chi phí trung bình O(1);
+        # bản nạp từ snapshot (memory-mapped, chỉ đọc) được chép ra RAM ở lần thêm đầu tiên
+        capacity = max(16, needed, self._buffer.shape[0] * 2)
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:self.size] = self._buffer[:self.size]
+        self._buffer = grown
+
+    def add(self, vectors):
+        """Thêm các vector (chưa chuẩn hóa); trả về id của vector đầu tiên."""
+        vectors = normalize(vectors)
+        if self.dim is None or (self.size == 0 and self.dim != vectors.shape[1]):
+            self.dim = vectors.shape[1]
+            self._buffer = np.empty((0, self.dim), dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: {vectors.shape[1]} != {self.dim}")
+        self._reserve(len(vectors))
+        start = self.size
+        self._buffer[start:start + len(vectors)] = vectors
+        self.size += len(vectors)
+        self._on_add(start, vectors)
+        return start
+
+    def _on_add(self, start, vectors):
+        pass
+
+    def scores(self, query):
+        """Cosine similarity với mọi vector."""
+        return self.vectors @ normalize(query)[0]
+
+    def search(self, query, k):
+        """Trả về (ids, scores) của k vector gần nhất, xếp giảm dần."""
+        if not self.size or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return _top_k(np.arange(self.size), self.scores(query), k)
+
+    def _state(self):
+        return {}, {}
+
+    def _restore(self, meta, arrays):
+        pass
+
+    def save(self, path, **extra):
+        """Ghi snapshot ra thư mục `path` (vectors.npy có thể nạp lại bằng memory map).
+
+        `extra` (ví dụ tên mô hình nhúng) được ghi kèm vào ann.json và đọc lại qua `meta` khi load.
+        """
+        os.makedirs(path, exist_ok=True)
+        meta, arrays = self._state()
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        with open(os.path.join(path, "ann.json"), "w", encoding="utf-8") as f:
+            json.dump({**extra, "kind": self.kind, "dim": self.dim, "size": self.size, **meta}, f)
+
+    @staticmethod
+    def load(path, mmap=True):
+        with open(os.path.join(path, "ann.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        cls = IVFIndex if meta["kind"] == "ivf" else BruteForceIndex
+        index = cls(dim=meta["dim"])
+        index._buffer = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index.size = meta["size"]
+        arrays = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy") and name != "vectors.npy":
+                arrays[name[:-4]] = np.load(os.path.join(path, name))
+        index._restore(meta, arrays)
+        index.meta = meta
+        return index
+
+
+class IVFIndex(BruteForceIndex):
+    """Inverted file index: gom vector thành các cụm (spherical k-means), chỉ quét nprobe cụm gần nhất.
+
+    Vector mới được gán vào cụm gần nhất ngay khi thêm; các cụm được huấn luyện lại
+    khi số vector tăng gấp đôi kể từ lần huấn luyện trước.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, dim=None, nlist=None, nprobe=None, min_size=None):
+        super().__init__(dim)
+        self.nlist = INDEX_ANN_NLIST if nlist is None else nlist
+        self.nprobe = INDEX_ANN_NPROBE if nprobe is None else nprobe
+        self.min_size = INDEX_ANN_MIN_SIZE if min_size is None else min_size
+        self.centroids = None
+        self.trained_size = 0
+        self._assign = np.empty(0, dtype=np.int32)
+
+    @property
+    def nbytes(self):
+        extra = self._assign.nbytes + (self.centroids.nbytes if self.centroids is not None else 0)
+        return super().nbytes + extra
+
+    def _on_add(self, start, vectors):
+        if self.centroids is None:
+            if self.size >= self.min_size:
+                self.train()
+            return
+        if self.size >= 2 * self.trained_size:
+            self.train()
+            return
+        if self._assign.shape[0] < self._buffer.shape[0]:
+            grown = np.empty(self._buffer.shape[0], dtype=np.int32)
+            grown[:start] = self._assign[:start]
+            self._assign = grown
+        self._assign[start:start + len(vectors)] = np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def train(self, iterations=8, sample_size=20000, seed=0):
+        """Huấn luyện lại các cụm trên một mẫu vector và gán lại toàn bộ."""
+        started = time.perf_counter()
+        vectors = self.vectors
+        nlist = self.nlist or int(np.clip(np.sqrt(self.size), 16, 4096))
+        nlist = min(nlist, self.size)
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(self.size, min(sample_size, self.size), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.flatnonzero(~sums.any(axis=1))
+            # Cụm rỗng: lấy ngẫu nhiên một điểm mẫu làm tâm mới
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            centroids = normalize(sums)
+        self.centroids = centroids
+        assign = np.empty(self._buffer.shape[0], dtype=np.int32)
+        for start in range(0, self.size, 8192):
+            block = vectors[start:start + 8192]
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        self._assign = assign
+        self.trained_size = self.size
+        logger.info(f"Đã huấn luyện IVF: {self.size} vector, {nlist} cụm, {time.perf_counter() - started:.2f}s")
+
+    def search(self, query, k):
+        if self.centroids is None or self.nprobe >= len(self.centroids):
+            return super().search(query, k)
+        if not self.size or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize(query)[0]
+        probes = np.argpartition(self.centroids @ query, -self.nprobe)[-self.nprobe:]
+        candidates = np.flatnonzero(np.isin(self._assign[:self.size], probes))
+        if not len(candidates):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return _top_k(candidates, self.vectors[candidates] @ query, k)
+
+    def _state(self):
+        if self.centroids is None:
+            return {"nlist": self.nlist, "nprobe": self.nprobe, "min_size": self.min_size}, {}
+        meta = {"nlist": self.nlist, "nprobe": self.nprobe, "min_size": self.min_size, "trained_size": self.trained_size}
+        return meta, {"centroids": self.centroids, "assign": self._assign[:self.size]}
+
+    def _restore(self, meta, arrays):
+        self.nlist = meta.get("nlist", self.nlist)
+        self.min_size = meta.get("min_size", self.min_size)
+        self.trained_size = meta.get("trained_size", 0)
+        if "centroids" in arrays:
+            self.centroids = arrays["centroids"]
+            self._assign = arrays["assign"]
+
+
+def make_index(kind=None, dim=None):
+    """Tạo chỉ mục theo INDEX_BACKEND."""
+    kind = kind or INDEX_BACKEND
+    if kind == "ivf":
+        return IVFIndex(dim=dim)
+    if kind != "exact":
+        logger.warning(f"INDEX_BACKEND không hợp lệ: {kind}, dùng exact")
+    return BruteForceIndex(dim=dim)
@@ -0,0 +1,168 @@
+import os
+import time
+import logging
+import threading
+from modules.storage import _get_firestore_client
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# "ttl": cache có thời hạn; "listener": đồng bộ qua Firestore snapshot listener
+AUTH_CACHE_MODE = os.getenv("AUTH_CACHE_MODE", "ttl")
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 300))
+AUTH_NEGATIVE_TTL = float(os.getenv("AUTH_NEGATIVE_TTL", 10))
+# Thời hạn của các user nạp sẵn khi khởi động (một lần đọc cho cả danh sách nên giữ lâu hơn)
+AUTH_PRELOAD_TTL = float(os.getenv("AUTH_PRELOAD_TTL", 6 * 3600))
+# Số mục tối đa (không tính các user do listener quản lý); mục hết hạn và cũ nhất bị loại trước
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", 10000))
+
+# user_id -> (đã xác thực, thời điểm hết hạn); thứ tự chèn = thứ tự loại bỏ
+_auth_cache = {}
+_auth_lock = threading.Lock()
+_listener = None
+_listener_synced = threading.Event()
+
+def _cache_set(user_id, is_authenticated, ttl=None):
+    if ttl is None:
+        ttl = AUTH_CACHE_TTL if is_authenticated else AUTH_NEGATIVE_TTL
+    now = time.monotonic()
+    expires = float("inf") if _listener_synced.is_set() and is_authenticated else now + ttl
+    with _auth_lock:
+        _auth_cache.pop(user_id, None)
+        if len(_auth_cache) >= AUTH_CACHE_MAX:
+            _prune_locked(now)
+        _auth_cache[user_id] = (is_authenticated, expires)
+
+def _prune_locked(now):
+    """Loại mục hết hạn; nếu vẫn đầy thì loại các mục có thời hạn cũ nhất.
+
+    Mục không hết hạn do listener quản lý: thiếu mục đó nghĩa là user chưa xác thực nên không được loại.
+    """
+    for user_id, (_, expires) in list(_auth_cache.items()):
+        if expires < now:
+            del _auth_cache[user_id]
+    for user_id, (_, expires) in list(_auth_cache.items()):
+        if len(_auth_cache) < AUTH_CACHE_MAX:
+            break
+        if expires != float("inf"):
+            del _auth_cache[user_id]
+
+def _cache_get(user_id):
+    with _auth_lock:
+        entry = _auth_cache.get(user_id)
+        if entry is not None and entry[1] < time.monotonic():
+            del _auth_cache[user_id]
+            return None
+    if entry is None:
+        return None
+    return entry[0]
+
+def invalidate_authentication(user_id):
+    with _auth_lock:
+        _auth_cache.pop(str(user_id), None)
+
+def _authenticated_users_query(db):
+    return db.collection("users").where("is_authenticated", "==", True)
+
+def preload_authenticated_users():
+    """Nạp sẵn danh sách người dùng đã xác thực vào cache (một lần đọc khi khởi động)."""
+    try:
+        db = _get_firestore_client()
+        count = 0
+        for doc in _authenticated_users_query(db).select(["is_authenticated"]).stream():
+            _cache_set(doc.id, True, ttl=AUTH_PRELOAD_TTL)
+            count += 1
+        logger.info(f"Đã nạp sẵn {count} người dùng đã xác thực")
+        return count
+    except Exception as e:
+        logger.error(f"Error preloading authenticated users: {str(e)}")
+        return 0
+
+def _on_snapshot(docs, changes, read_time):
+    with _auth_lock:
+        for change in changes:
+            user_id = change.document.id
+            if change.type.name == "REMOVED":
+                _auth_cache.pop(user_id, None)
+            else:
+                _auth_cache[user_id] = (True, float("inf"))
+    if not _listener_synced.is_set():
+        _listener_synced.set()
+        logger.info(f"Snapshot listener đã đồng bộ {len(docs)} người dùng đã xác thực")
+
+def start_auth_listener():
+    """Theo dõi thay đổi xác thực qua snapshot listener để thu hồi quyền không cần polling."""
+    global _listener
+    if _listener is None:
+        db = _get_firestore_client()
+        _listener = _authenticated_users_query(db).on_snapshot(_on_snapshot)
+    return _listener
+
+def start_auth_cache():
+    """Khởi động cache xác thực theo AUTH_CACHE_MODE."""
+    if AUTH_CACHE_MODE == "listener":
+        try:
+            start_auth_listener()
+            return
+        except Exception as e:
+            logger.error(f"Error starting auth listener, falling back to TTL cache: {str(e)}")
+    preload_authenticated_users()
+
+def stop_auth_cache():
+    global _listener
+    if _listener is not None:
+        _listener.unsubscribe()
+        _listener = None
+        _listener_synced.clear()
+
+def authenticate_user(user_id, password):
+    """Xác thực người dùng bằng mật khẩu."""
+    try:
+        user_id = str(user_id)
+        correct_password = os.getenv("BOT_PASSWORD")
+        if not correct_password:
+            logger.error("BOT_PASSWORD is not set")
+            return False, "Lỗi hệ thống: Mật khẩu bot chưa được thiết lập."
+
+        if password != correct_password:
+            logger.warning(f"Wrong password attempt for user {user_id}")
+            return False, "Mật khẩu không đúng. Vui lòng thử lại."
+
+        # Lưu trạng thái xác thực vào Firestore
+        db = _get_firestore_client()
+        from google.cloud import firestore
+        db.collection("users").document(user_id).set({
+            "is_authenticated": True,
+            "timestamp": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+        _cache_set(user_id, True)
+        logger.info(f"User {user_id} authenticated successfully")
+        return True, "Xác thực thành công! Bạn có thể sử dụng bot."
+
+    except Exception as e:
+        logger.error(f"Error authenticating user {user_id}: {str(e)}")
+        return False, f"Lỗi khi xác thực: {str(e)}"
+
+def check_authentication(user_id):
+    """Kiểm tra trạng thái xác thực của người dùng."""
+    try:
+        user_id = str(user_id)
+        cached = _cache_get(user_id)
+        if cached is not None:
+            return cached
+        # Listener đã đồng bộ thì mọi user đã xác thực đều nằm trong cache
+        if _listener_synced.is_set():
+            return False
+
+        db = _get_firestore_client()
+        doc = db.collection("users").document(user_id).get()
+        if doc.exists and doc.to_dict().get("is_authenticated", False):
+            _cache_set(user_id, True)
+            logger.debug("User %s is authenticated", user_id)
+            return True
+        _cache_set(user_id, False)
+        logger.warning(f"User {user_id} is not authenticated")
+        return False
+    except Exception as e:
+        logger.error(f"Error checking authentication for user {user_id}: {str(e)}")
+        return False
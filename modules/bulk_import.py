@@ -0,0 +1,178 @@
+# bulk_import.py
+"""Nhập dữ liệu huấn luyện hàng loạt từ file JSON/JSONL/CSV/văn bản.
+
+Dùng qua Telegram (gửi file cho bot) hoặc dòng lệnh:
+    python -m modules.bulk_import --user <chat_id> data.jsonl
+"""
+import os
+import io
+import csv
+import json
+import argparse
+import logging
+from modules.index import get_user_index
+from utils.chunker import chunk_text, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP
+from utils.cleaner import clean_input
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+BULK_IMPORT_MAX_BYTES = int(os.getenv("BULK_IMPORT_MAX_BYTES", 5 * 1024 * 1024))
+# Số bản ghi mỗi lần encode + commit để giới hạn bộ nhớ khi file lớn
+BULK_IMPORT_BATCH = int(os.getenv("BULK_IMPORT_BATCH", 500))
+
+_CONTENT_FIELDS = ("content", "text")
+
+
+def _content(item):
+    """Nội dung của một phần tử JSON (chuỗi, hoặc object có trường content/text); None nếu không có."""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        value = next((item[field] for field in _CONTENT_FIELDS if item.get(field)), None)
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def _from_jsonl(text):
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Bỏ qua dòng JSON không hợp lệ {line_no}")
+            continue
+        value = _content(item)
+        if value is not None:
+            yield value
+
+
+def _from_json(text):
+    """File .json: một mảng (hoặc một object) trên toàn file; không parse được thì đọc như JSONL."""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        yield from _from_jsonl(text)
+        return
+    for item in data if isinstance(data, list) else [data]:
+        value = _content(item)
+        if value is not None:
+            yield value
+
+
+def _from_csv(text):
+    rows = csv.reader(io.StringIO(text))
+    header = next(rows, None)
+    if header is None:
+        return
+    lowered = [column.strip().lower() for column in header]
+    column = next((lowered.index(field) for field in _CONTENT_FIELDS if field in lowered), None)
+    if column is None:
+        # Không có tiêu đề phù hợp: dòng đầu cũng là dữ liệu, lấy cột đầu tiên
+        column = 0
+        rows = [header, *rows]
+    for row in rows:
+        if len(row) > column:
+            yield row[column]
+
+
+def _from_text(text):
+    # Mỗi đoạn (ngăn cách bởi dòng trống) là một bản ghi
+    for paragraph in text.replace("\r\n", "\n").split("\n\n"):
+        yield paragraph
+
+
+def parse_training_file(filename, raw):
+    """Đọc file (bytes) thành danh sách nội dung đã làm sạch, chia đoạn và loại trùng."""
+    text = raw.decode("utf-8-sig", errors="replace")
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".json":
+        items = _from_json(text)
+    elif extension in (".jsonl", ".ndjson"):
+        items = _from_jsonl(text)
+    elif extension == ".csv":
+        items = _from_csv(text)
+    else:
+        items = _from_text(text)
+
+    seen = set()
+    contents = []
+    for item in items:
+        cleaned = clean_input(item)
+        for chunk in chunk_text(cleaned, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP):
+            if chunk not in seen:
+                seen.add(chunk)
+                contents.append(chunk)
+    return contents
+
+
+def import_training_data(user_id, contents, source):
+    """Lưu các nội dung chưa có trong dữ liệu của user; trả về (số đã lưu, số bị trùng)."""
+    from modules.storage import save_many_to_firestore
+    _, existing = get_user_index(user_id).snapshot()
+    existing = {record.get("content") for record in existing}
+    new_contents = [content for content in contents if content not in existing]
+    duplicates = len(contents) - len(new_contents)
+
+    saved = 0
+    for start in range(0, len(new_contents), BULK_IMPORT_BATCH):
+        records = [{
+            "content": content,
+            "type": "file",
+            "source": source
+        } for content in new_contents[start:start + BULK_IMPORT_BATCH]]
+        saved += save_many_to_firestore(user_id, records)
+        logger.info(f"Bulk import cho user {user_id}: {saved}/{len(new_contents)} bản ghi")
+    return saved, duplicates
+
+
+def handle_document(user_id, bot, document):
+    """Xử lý file người dùng gửi qua Telegram."""
+    try:
+        if document.file_size and document.file_size > BULK_IMPORT_MAX_BYTES:
+            return f"File quá lớn, tối đa {BULK_IMPORT_MAX_BYTES // (1024 * 1024)} MB."
+        raw = bytes(bot.get_file(document.file_id).download_as_bytearray())
+        contents = parse_training_file(document.file_name, raw)
+        if not contents:
+            return "Không tìm thấy nội dung hợp lệ trong file."
+        saved, duplicates = import_training_data(user_id, contents, document.file_name or "telegram")
+        return f"Đã nhập {saved} bản ghi từ {document.file_name} (bỏ qua {duplicates} bản ghi trùng)."
+    except Exception as e:
+        logger.error(f"Error importing document for user {user_id}: {str(e)}", exc_info=True)
+        return f"Lỗi khi nhập file: {str(e)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhập dữ liệu huấn luyện hàng loạt cho một người dùng hoặc một kho kiến thức.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user", help="chat_id của người dùng nhận dữ liệu")
+    target.add_argument("--kb", help="mã kho kiến thức dùng chung (tạo mới nếu chưa có)")
+    parser.add_argument("--title", help="tên hiển thị của kho kiến thức")
+    parser.add_argument("files", nargs="+", help="file .json, .jsonl, .csv hoặc văn bản")
+    args = parser.parse_args()
+
+    owner = args.user
+    if args.kb:
+        from modules.knowledge import create_knowledge_base
+        owner = create_knowledge_base(args.kb, args.title)
+
+    total_saved = total_duplicates = 0
+    for path in args.files:
+        with open(path, "rb") as f:
+            contents = parse_training_file(path, f.read())
+        saved, duplicates = import_training_data(owner, contents, os.path.basename(path))
+        total_saved += saved
+        total_duplicates += duplicates
+        print(f"{path}: {saved} bản ghi mới, {duplicates} bản ghi trùng")
+    if total_saved:
+        # Bot đang chạy so updated_at định kỳ để nạp lại chỉ mục của user/kho
+        from modules.storage import touch_user_data
+        touch_user_data(owner)
+    print(f"Tổng cộng: {total_saved} bản ghi mới, {total_duplicates} bản ghi trùng")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# dedup.py
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# "memory": trong tiến trình; "sqlite": file dùng chung giữa các worker trên cùng máy;
+# "firestore": collection dùng chung giữa các máy (bật TTL policy trên trường expires_at)
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+# Telegram chỉ gửi lại update trong khoảng 24 giờ
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 24 * 3600))
+DEDUP_MAX_KEYS = int(os.getenv("DEDUP_MAX_KEYS", 100000))
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "/tmp/cotienbot-dedup.sqlite3")
+DEDUP_COLLECTION = os.getenv("DEDUP_COLLECTION", "processed_updates")
+# Số lần claim giữa hai lần xóa các khóa hết hạn trong SQLite
+DEDUP_PURGE_EVERY = int(os.getenv("DEDUP_PURGE_EVERY", 1000))
+
+
+def update_key(update):
+    """Khóa loại trùng: update_id nếu có, nếu không thì (chat_id, message_id)."""
+    if getattr(update, "update_id", None) is not None:
+        return f"u:{update.update_id}"
+    return f"m:{update.message.chat_id}:{update.message.message_id}"
+
+
+class MemoryDedup:
+    """Tập khóa có thời hạn trong bộ nhớ; khóa cũ nhất luôn nằm đầu OrderedDict."""
+
+    name = "memory"
+
+    def __init__(self, ttl, max_keys=DEDUP_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        now = time.monotonic()
+        with self._lock:
+            while self._keys and next(iter(self._keys.values())) <= now:
+                self._keys.popitem(last=False)
+            if key in self._keys:
+                return False
+            if len(self._keys) >= self.max_keys:
+                self._keys.popitem(last=False)
+            self._keys[key] = now + self.ttl
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+
+class SQLiteDedup:
+    """Khóa lưu trong file SQLite; INSERT OR IGNORE bảo đảm chỉ một worker claim được."""
+
+    name = "sqlite"
+
+    def __init__(self, ttl, path=DEDUP_SQLITE_PATH, purge_every=DEDUP_PURGE_EVERY):
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._claims = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def claim(self, key):
+        now = time.time()
+        with self._lock:
+            self._claims += 1
+            if self._claims % self.purge_every == 0:
+                self._conn.execute("DELETE FROM dedup WHERE expires <= ?", (now,))
+            # Một câu lệnh duy nhất nên các tiến trình khác không chen vào giữa được
+            cursor = self._conn.execute(
+                "INSERT INTO dedup (key, expires) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET expires = excluded.expires WHERE dedup.expires <= ?",
+                (key, now + self.ttl, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup WHERE key = ?", (key,))
+
+
+class FirestoreDedup:
+    """Mỗi khóa là một document; create() thất bại nếu document đã tồn tại.
+
+    Firestore TTL policy trên trường expires_at dọn các document cũ, nhưng có thể trễ
+    đến 24 giờ nên document đã hết hạn vẫn được kiểm tra và ghi đè.
+    """
+
+    name = "firestore"
+
+    def __init__(self, ttl, collection=DEDUP_COLLECTION):
+        self.ttl = ttl
+        self.collection = collection
+
+    def _doc(self, key):
+        from modules.storage import _get_firestore_client
+        return _get_firestore_client().collection(self.collection).document(key)
+
+    def claim(self, key):
+        from google.api_core.exceptions import AlreadyExists
+        doc = self._doc(key)
+        now = datetime.now(timezone.utc)
+        entry = {"expires_at": now + timedelta(seconds=self.ttl)}
+        try:
+            doc.create(entry)
+            return True
+        except AlreadyExists:
+            snapshot = doc.get()
+            expires = snapshot.get("expires_at") if snapshot.exists else None
+            if expires is not None and expires > now:
+                return False
+            doc.set(entry)
+            return True
+
+    def release(self, key):
+        self._doc(key).delete()
+
+
+def _make_store(backend):
+    if backend == "sqlite":
+        return SQLiteDedup(DEDUP_TTL)
+    if backend == "firestore":
+        return FirestoreDedup(DEDUP_TTL)
+    if backend != "memory":
+        logger.warning(f"DEDUP_BACKEND không hợp lệ: {backend}, dùng memory")
+    return MemoryDedup(DEDUP_TTL)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _make_store(DEDUP_BACKEND)
+    return _store
+
+
+def claim_update(key):
+    """Đánh dấu khóa đã xử lý; trả về False nếu khóa đã được claim (update bị gửi lại)."""
+    store = _get_store()
+    try:
+        claimed = store.claim(key)
+    except Exception as e:
+        # Kho loại trùng lỗi thì vẫn xử lý: trả lời trùng tốt hơn bỏ sót tin nhắn
+        logger.error(f"Lỗi kiểm tra trùng {key} ({store.name}): {str(e)}")
+        metrics.inc("dedup_errors_total", backend=store.name)
+        return True
+    if not claimed:
+        metrics.inc("dedup_duplicates_total", backend=store.name)
+    return claimed
+
+
+def release_update(key):
+    """Bỏ claim để Telegram gửi lại update được xử lý (ví dụ khi hàng đợi đầy)."""
+    store = _get_store()
+    try:
+        store.release(key)
+    except Exception as e:
+        logger.error(f"Lỗi bỏ claim {key} ({store.name}): {str(e)}")
+        metrics.inc("dedup_errors_total", backend=store.name)
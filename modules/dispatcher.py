@@ -0,0 +1,84 @@
+# dispatcher.py
+import time
+import queue
+import threading
+import logging
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WorkerPool:
+    """Pool luồng xử lý update; cùng một key (chat_id) luôn vào cùng một hàng đợi để giữ thứ tự."""
+
+    def __init__(self, handler, workers=4, queue_size=100, name="worker"):
+        self.handler = handler
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._closed = False
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._run, args=(q,), name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def submit(self, key, item, timeout=0):
+        """Đưa việc vào hàng đợi; trả về False nếu pool đã đóng hoặc hàng đợi đầy.
+
+        timeout > 0 chờ tối đa bấy nhiêu giây khi hàng đợi đầy (None = chờ đến khi có chỗ).
+        """
+        if self._closed:
+            return False
+        q = self._queues[hash(key) % len(self._queues)]
+        try:
+            if timeout == 0:
+                q.put_nowait(item)
+            else:
+                q.put(item, timeout=timeout)
+        except queue.Full:
+            metrics.inc("dispatcher_rejected_total", pool=self.name)
+            logger.warning(f"Hàng đợi {self.name} đầy, từ chối update của {key}")
+            return False
+        metrics.inc("dispatcher_enqueued_total", pool=self.name)
+        metrics.set_gauge("dispatcher_queue_depth", self.depth(), pool=self.name)
+        return True
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(item)
+                metrics.inc("dispatcher_processed_total", pool=self.name)
+            except Exception as e:
+                metrics.inc("dispatcher_failed_total", pool=self.name)
+                logger.error(f"Lỗi khi xử lý update trong {self.name}: {str(e)}", exc_info=True)
+            finally:
+                q.task_done()
+                metrics.set_gauge("dispatcher_queue_depth", self.depth(), pool=self.name)
+
+    def drain(self, timeout=25):
+        """Ngừng nhận việc mới, xử lý hết hàng đợi rồi dừng các luồng."""
+        if self._closed:
+            return
+        self._closed = True
+        logger.info(f"Đang xử lý nốt {self.depth()} update trong {self.name} trước khi dừng")
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            # Hàng đợi đầy thì chờ worker giải phóng chỗ, nhưng không quá hạn chót
+            try:
+                q.put(_STOP, timeout=max(0.001, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        remaining = self.depth()
+        if remaining:
+            logger.warning(f"{self.name} dừng khi còn {remaining} update chưa xử lý")
@@ -0,0 +1,162 @@
+# embedder.py
+import os
+import queue
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-MiniLM-L3-v2")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", 2048))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 32))
+# Thời gian chờ gom thêm yêu cầu (ms); 0 = chỉ gom các yêu cầu đang xếp hàng
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", 0))
+
+# Mô hình dùng chung cho toàn bộ tiến trình, chỉ nạp khi cần (hoặc khi warm-up)
+_model = None
+_model_lock = threading.Lock()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+_pending = queue.Queue()
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+class _Request:
+    __slots__ = ("text", "event", "vector", "error")
+
+    def __init__(self, text):
+        self.text = text
+        self.event = threading.Event()
+        self.vector = None
+        self.error = None
+
+
+def _get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                logger.info(f"Đang nạp mô hình {EMBEDDING_MODEL}...")
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(EMBEDDING_MODEL)
+                logger.info(f"Đã nạp mô hình {EMBEDDING_MODEL}")
+    return _model
+
+
+def is_model_loaded():
+    return _model is not None
+
+
+def embedding_dimension():
+    """Số chiều vector của mô hình; None nếu mô hình chưa được nạp."""
+    return _model.get_sentence_embedding_dimension() if _model is not None else None
+
+
+def warm_up():
+    """Nạp mô hình và chạy thử một lần nhúng để lần gọi đầu tiên không bị chậm."""
+    _get_model().encode(["warm up"], convert_to_numpy=True)
+
+
+def _cache_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        vector = _cache.get(key)
+        if vector is not None:
+            _cache.move_to_end(key)
+        return vector
+
+
+def _cache_put(key, vector):
+    if EMBED_CACHE_SIZE <= 0:
+        return
+    with _cache_lock:
+        _cache[key] = vector
+        _cache.move_to_end(key)
+        while len(_cache) > EMBED_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _encode(texts):
+    vectors = _get_model().encode(texts, batch_size=EMBED_BATCH_SIZE, convert_to_numpy=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    # Vector trong cache được dùng chung giữa các luồng nên chỉ cho đọc
+    vectors.setflags(write=False)
+    return vectors
+
+
+def _batch_loop():
+    wait = EMBED_BATCH_WAIT_MS / 1000.0
+    while True:
+        batch = [_pending.get()]
+        while len(batch) < EMBED_BATCH_SIZE:
+            try:
+                batch.append(_pending.get(timeout=wait) if wait else _pending.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            vectors = _encode([request.text for request in batch])
+            for request, vector in zip(batch, vectors):
+                request.vector = vector
+        except Exception as e:
+            logger.error(f"Lỗi khi nhúng batch {len(batch)} câu: {str(e)}")
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.event.set()
+
+
+def _ensure_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = threading.Thread(target=_batch_loop, name="embedder-batcher", daemon=True)
+                _batcher.start()
+
+
+def encode_one(text):
+    """Nhúng một câu (đã làm sạch); các yêu cầu đồng thời được gom thành một batch."""
+    key = _cache_key(text)
+    vector = _cache_get(key)
+    if vector is not None:
+        return vector
+
+    _ensure_batcher()
+    request = _Request(text)
+    _pending.put(request)
+    request.event.wait()
+    if request.error is not None:
+        raise request.error
+    _cache_put(key, request.vector)
+    return request.vector
+
+
+def encode_many(texts):
+    """Nhúng nhiều câu trong một lần gọi mô hình, bỏ qua các câu đã có trong cache."""
+    keys = [_cache_key(text) for text in texts]
+    vectors = [_cache_get(key) for key in keys]
+    missing = {}
+    for i, vector in enumerate(vectors):
+        if vector is None:
+            missing.setdefault(texts[i], []).append(i)
+
+    if missing:
+        encoded = _encode(list(missing))
+        for (text, positions), vector in zip(missing.items(), encoded):
+            _cache_put(keys[positions[0]], vector)
+            for i in positions:
+                vectors[i] = vector
+
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack(vectors)
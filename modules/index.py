@@ -0,0 +1,370 @@
+# index.py
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import logging
+from collections import OrderedDict
+import numpy as np
+from modules.ann import INDEX_BACKEND, make_index, normalize, BruteForceIndex
+from modules.lexical import BM25Index
+from modules.embedder import EMBEDDING_MODEL, embedding_dimension
+from utils import metrics
+from utils.vectors import decode_vector, strip_vector_fields
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# Giới hạn bộ nhớ cho các chỉ mục đang nằm trong RAM (LRU theo số user hoặc theo số byte)
+INDEX_MAX_USERS = int(os.getenv("INDEX_MAX_USERS", 200))
+INDEX_MAX_BYTES = int(os.getenv("INDEX_MAX_BYTES", 64 * 1024 * 1024))
+# Thư mục lưu snapshot chỉ mục để khởi động lại nhanh (bỏ trống = không lưu)
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", "")
+# Dữ liệu có thể được ghi từ tiến trình khác (bulk_import, reembed): định kỳ so updated_at của
+# users/{id} hoặc knowledge_bases/{id} để nạp lại chỉ mục (0 = tắt)
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", 60))
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+# user_id -> [số luồng đang nạp chỉ mục, số bản ghi được thêm trong lúc nạp]
+_loading = {}
+
+
+def _record_nbytes(record):
+    """Ước lượng bộ nhớ của một bản ghi (dict + các giá trị; tên trường dùng chung giữa các bản ghi)."""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+
+class UserIndex:
+    """Chỉ mục trong bộ nhớ của một người dùng: bản ghi + backend vector + chỉ mục BM25."""
+
+    def __init__(self, records, embeddings, backend=None):
+        self.lock = threading.Lock()
+        self.records = list(records)
+        self.backend = backend if backend is not None else make_index()
+        if self.records and not len(self.backend):
+            self.backend.add(embeddings)
+        self.lexical = BM25Index()
+        self._records_nbytes = 0
+        for record in self.records:
+            self.lexical.add(record.get("content", ""))
+            self._records_nbytes += _record_nbytes(record)
+        # Snapshot cần ghi lại khi có bản ghi mới chưa được lưu
+        self.dirty = False
+        # Số bản ghi trên Firestore không có trong chỉ mục (thiếu embedding hoặc khác mô hình)
+        self.skipped = 0
+        self.skipped_latest = None
+        # updated_at lúc nạp và lần kiểm tra gần nhất (xem INDEX_REFRESH_SECONDS)
+        self.version = None
+        self.checked_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def nbytes(self):
+        """Ước lượng bộ nhớ: vector + chỉ mục BM25 + danh sách bản ghi (dùng cho INDEX_MAX_BYTES)."""
+        records = sys.getsizeof(self.records) + self._records_nbytes
+        return self.backend.nbytes + self.lexical.nbytes + records
+
+    def append(self, record, embedding):
+        """Thêm một bản ghi vào chỉ mục."""
+        with self.lock:
+            self.backend.add(embedding)
+            self.lexical.add(record.get("content", ""))
+            self.records.append(record)
+            self._records_nbytes += _record_nbytes(record)
+            self.dirty = True
+
+    def snapshot(self):
+        """Trả về (ma trận, danh sách bản ghi) nhất quán tại thời điểm gọi."""
+        with self.lock:
+            return self.backend.vectors, self.records[:]
+
+    def search(self, query_embedding):
+        """Tính cosine similarity chính xác với mọi bản ghi bằng một phép nhân ma trận-vector."""
+        with self.lock:
+            if not self.records:
+                return np.empty(0, dtype=np.float32), []
+            return self.backend.scores(query_embedding), self.records[:]
+
+    def semantic_top_k(self, query_embedding, k, threshold=None):
+        """Trả về tối đa k cặp (vị trí bản ghi, cosine) xếp hạng giảm dần."""
+        with self.lock:
+            if not self.records or k <= 0:
+                return []
+            ids, scores = self.backend.search(query_embedding, k)
+        results = []
+        for i, score in zip(ids, scores):
+            score = float(score)
+            if threshold is not None and score <= threshold:
+                break
+            results.append((int(i), score))
+        return results
+
+    def cosine(self, query_embedding, positions):
+        """Cosine similarity giữa câu hỏi và các bản ghi ở `positions`."""
+        with self.lock:
+            vectors = self.backend.vectors[np.asarray(positions, dtype=np.int64)]
+        return vectors @ normalize(query_embedding)[0]
+
+    def lexical_top_k(self, query, k):
+        """Trả về tối đa k bộ (vị trí bản ghi, điểm BM25, độ phủ từ khóa) xếp hạng giảm dần."""
+        with self.lock:
+            ids, scores, coverage = self.lexical.search(query, k)
+        return [(int(i), float(score), float(cover)) for i, score, cover in zip(ids, scores, coverage)]
+
+    def record(self, position):
+        with self.lock:
+            return self.records[position]
+
+    def top_k(self, query_embedding, k, threshold=None):
+        """Trả về tối đa k cặp (bản ghi, điểm) xếp hạng giảm dần."""
+        return [(self.record(i), score) for i, score in self.semantic_top_k(query_embedding, k, threshold)]
+
+    def save(self, path):
+        """Ghi snapshot (bản ghi + vector) ra thư mục `path`."""
+        with self.lock:
+            tmp_path = path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            self.backend.save(tmp_path, embedding_model=EMBEDDING_MODEL, latest_timestamp=self._latest_timestamp(), skipped=self.skipped)
+            with open(os.path.join(tmp_path, "records.json"), "w", encoding="utf-8") as f:
+                json.dump(self.records, f, ensure_ascii=False, default=str)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    def _latest_timestamp(self):
+        # Bản ghi thêm trong lúc chạy chưa có timestamp của Firestore: snapshot sẽ bị coi là cũ
+        # ở lần nạp sau và được xây dựng lại một lần
+        timestamps = [str(record["timestamp"]) for record in self.records if record.get("timestamp")]
+        if self.skipped_latest:
+            timestamps.append(self.skipped_latest)
+        return max(timestamps) if timestamps else None
+
+    @classmethod
+    def load(cls, path):
+        """Nạp snapshot; vector được memory-map nên khởi động gần như tức thì."""
+        with open(os.path.join(path, "records.json"), encoding="utf-8") as f:
+            records = json.load(f)
+        return cls(records, None, backend=BruteForceIndex.load(path))
+
+
+def _snapshot_path(user_id):
+    return os.path.join(INDEX_SNAPSHOT_DIR, str(user_id))
+
+
+def _load_snapshot(user_id):
+    """Dùng snapshot nếu cùng mô hình nhúng và vẫn khớp với Firestore.
+
+    So số bản ghi (truy vấn count) và timestamp của bản ghi mới nhất (đọc một document)
+    thay vì đọc toàn bộ; xóa rồi thêm bản ghi giữ nguyên số lượng nhưng đổi timestamp mới nhất.
+    """
+    path = _snapshot_path(user_id)
+    if not INDEX_SNAPSHOT_DIR or not os.path.isdir(path):
+        return None
+    try:
+        from modules.storage import count_user_data, latest_user_data_timestamp
+        index = UserIndex.load(path)
+        meta = index.backend.meta
+        if index.backend.kind != INDEX_BACKEND:
+            logger.info(f"Snapshot của user {user_id} dùng backend {index.backend.kind}, xây dựng lại")
+            return None
+        dim = embedding_dimension()
+        if meta.get("embedding_model") != EMBEDDING_MODEL or (dim is not None and len(index) and index.backend.dim != dim):
+            logger.info(f"Snapshot của user {user_id} dùng mô hình {meta.get('embedding_model')} ({index.backend.dim} chiều), xây dựng lại")
+            return None
+        index.skipped = meta.get("skipped", 0)
+        index.skipped_latest = meta.get("latest_timestamp")
+        count = count_user_data(user_id)
+        if count is None or count != len(index) + index.skipped:
+            logger.info(f"Snapshot của user {user_id} đã cũ ({len(index) + index.skipped} != {count}), xây dựng lại")
+            return None
+        latest = latest_user_data_timestamp(user_id) if count else None
+        if latest == meta.get("latest_timestamp"):
+            logger.info(f"Nạp chỉ mục của user {user_id} từ snapshot ({len(index)} bản ghi)")
+            return index
+        logger.info(f"Snapshot của user {user_id} đã cũ (bản ghi mới nhất {latest}), xây dựng lại")
+    except Exception as e:
+        logger.warning(f"Không thể nạp snapshot của user {user_id}: {str(e)}")
+    return None
+
+
+def _save_snapshot(user_id, index):
+    if not INDEX_SNAPSHOT_DIR:
+        return
+    try:
+        index.save(_snapshot_path(user_id))
+    except Exception as e:
+        logger.warning(f"Không thể lưu snapshot của user {user_id}: {str(e)}")
+
+
+def _is_outdated(user_id, index):
+    """True nếu dữ liệu đã được cập nhật (updated_at khác) kể từ khi chỉ mục được nạp."""
+    if INDEX_REFRESH_SECONDS <= 0:
+        return False
+    now = time.monotonic()
+    with index.lock:
+        if now < index.checked_at + INDEX_REFRESH_SECONDS:
+            return False
+        # Chỉ một luồng kiểm tra trong mỗi chu kỳ
+        index.checked_at = now
+    from modules.storage import user_data_version
+    version = user_data_version(user_id)
+    if version is None or version == index.version:
+        return False
+    logger.info(f"Dữ liệu của {user_id} đã được cập nhật, nạp lại chỉ mục")
+    return True
+
+
+def _load_user_index(user_id):
+    # Đọc updated_at trước dữ liệu để mọi lần nhập sau đó đều làm phiên bản thay đổi
+    version = None
+    if INDEX_REFRESH_SECONDS > 0:
+        from modules.storage import user_data_version
+        version = user_data_version(user_id)
+
+    index = _load_snapshot(user_id)
+    if index is not None:
+        index.version = version
+        return index
+
+    from modules.storage import get_user_data
+    records, embeddings = [], []
+    skipped = other_model = 0
+    dim = embedding_dimension()
+    skipped_latest = None
+    for item in get_user_data(user_id):
+        embedding = decode_vector(item)
+        model = item.get("embedding_model")
+        # Trong lúc reembed chạy dở, bản ghi của mô hình khác không so sánh được với câu hỏi
+        other = embedding is not None and (
+            (model and model != EMBEDDING_MODEL) or (dim is not None and len(embedding) != dim)
+        )
+        if embedding is None or other:
+            # Bỏ qua nhưng vẫn tính vào số lượng và timestamp mới nhất để so với snapshot
+            skipped += 1
+            other_model += bool(other)
+            if item.get("timestamp"):
+                skipped_latest = max(skipped_latest or "", str(item["timestamp"]))
+            continue
+        records.append(strip_vector_fields(item))
+        embeddings.append(embedding)
+    if other_model:
+        metrics.inc("index_records_other_model_total", other_model)
+        logger.warning(f"Bỏ qua {other_model} bản ghi của user {user_id} được nhúng bằng mô hình khác với {EMBEDDING_MODEL}")
+    logger.info(f"Đã xây dựng chỉ mục cho user {user_id} với {len(records)} bản ghi")
+    index = UserIndex(records, embeddings)
+    index.skipped = skipped
+    index.skipped_latest = skipped_latest
+    index.version = version
+    # Chỉ ghi snapshot khi chỉ mục được đưa vào cache (xem get_user_index)
+    index.dirty = True
+    return index
+
+
+def _evict_locked():
+    evicted = []
+    total = sum(index.nbytes for index in _indexes.values())
+    while len(_indexes) > 1 and (len(_indexes) > INDEX_MAX_USERS or total > INDEX_MAX_BYTES):
+        user_id, index = _indexes.popitem(last=False)
+        total -= index.nbytes
+        evicted.append((user_id, index))
+        logger.info(f"Giải phóng chỉ mục của user {user_id} ({index.nbytes} bytes)")
+    return evicted
+
+
+def _persist_evicted(evicted):
+    for user_id, index in evicted:
+        if index.dirty:
+            _save_snapshot(user_id, index)
+
+
+def get_user_index(user_id):
+    """Lấy chỉ mục của người dùng, xây dựng từ Firestore ở lần truy cập đầu tiên."""
+    user_id = str(user_id)
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+    if index is not None:
+        if not _is_outdated(user_id, index):
+            return index
+        invalidate_user_index(user_id)
+
+    with _indexes_lock:
+        state = _loading.setdefault(user_id, [0, 0])
+        state[0] += 1
+        writes = state[1]
+
+    # Đọc Firestore ngoài khóa để không chặn các user khác; lỗi đọc được ném ra và không cache gì
+    try:
+        index = _load_user_index(user_id)
+    finally:
+        with _indexes_lock:
+            state[0] -= 1
+            if not state[0]:
+                _loading.pop(user_id, None)
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if state[1] != writes:
+            # Có bản ghi mới được lưu trong lúc đọc và có thể không nằm trong kết quả đọc:
+            # dùng chỉ mục này cho lần gọi hiện tại nhưng không cache, lần sau nạp lại
+            return cached if cached is not None else index
+        index = _indexes.setdefault(user_id, index)
+        _indexes.move_to_end(user_id)
+        evicted = _evict_locked()
+    if index is not cached and index.dirty:
+        _save_snapshot(user_id, index)
+    _persist_evicted(evicted)
+    return index
+
+
+def add_to_user_index(user_id, record, embedding):
+    """Bổ sung bản ghi mới vào chỉ mục nếu chỉ mục của user đang nằm trong bộ nhớ."""
+    user_id = str(user_id)
+    if embedding is None or not len(embedding):
+        return
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None and user_id in _loading:
+            _loading[user_id][1] += 1
+    if index is None:
+        # Snapshot trên đĩa (nếu có) sẽ bị phát hiện là cũ nhờ so sánh số bản ghi
+        return  # Sẽ được nạp đầy đủ từ Firestore ở lần truy cập sau
+    try:
+        index.append(record, embedding)
+    except ValueError as e:
+        logger.warning(f"Không thể bổ sung chỉ mục cho user {user_id}: {str(e)}")
+        invalidate_user_index(user_id)
+        return
+    with _indexes_lock:
+        evicted = _evict_locked()
+    _persist_evicted(evicted)
+
+
+def invalidate_user_index(user_id):
+    """Xóa chỉ mục của người dùng khỏi bộ nhớ (và snapshot trên đĩa)."""
+    with _indexes_lock:
+        _indexes.pop(str(user_id), None)
+    if INDEX_SNAPSHOT_DIR:
+        shutil.rmtree(_snapshot_path(user_id), ignore_errors=True)
+
+
+def save_index_snapshots(timeout=None):
+    """Ghi snapshot cho các chỉ mục có thay đổi (gọi khi tắt tiến trình).
+
+    Hết `timeout` giây thì dừng; chỉ mục chưa ghi sẽ được nạp lại từ Firestore lần sau.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _indexes_lock:
+        items = list(_indexes.items())
+    for user_id, index in items:
+        if deadline is not None and time.monotonic() >= deadline:
+            skipped = sum(1 for _, other in items if other.dirty)
+            logger.warning(f"Hết thời gian tắt, bỏ qua snapshot của {skipped} chỉ mục")
+            break
+        if index.dirty:
+            _save_snapshot(user_id, index)
@@ -0,0 +1,114 @@
+# knowledge.py
+import os
+import re
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from modules.storage import _get_firestore_client, knowledge_base_key
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# Kho kiến thức dùng chung: knowledge_bases/{kb_id}/trained_data, lưu và nhúng một lần.
+# Chat đăng ký qua users/{chat_id}/subscriptions/{kb_id}.
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", 300))
+MAX_SUBSCRIPTIONS = int(os.getenv("MAX_SUBSCRIPTIONS", 10))
+
+# Mã kho đi qua clean_input (chữ thường, bỏ ký tự đặc biệt) nên chỉ dùng chữ thường, số và "_"
+_KB_ID = re.compile(r"^[a-z0-9_]{1,64}$")
+
+# user_id -> (danh sách kb_id, thời điểm hết hạn)
+_subscriptions = {}
+_subscriptions_lock = threading.Lock()
+
+
+def is_valid_kb_id(kb_id):
+    return bool(kb_id) and bool(_KB_ID.match(kb_id))
+
+
+def _subscriptions_collection(db, user_id):
+    return db.collection("users").document(str(user_id)).collection("subscriptions")
+
+
+def create_knowledge_base(kb_id, title=None):
+    """Tạo (hoặc cập nhật) thông tin kho kiến thức; dữ liệu được nhập bằng bulk_import --kb."""
+    if not is_valid_kb_id(kb_id):
+        raise ValueError(f"Mã kho kiến thức không hợp lệ: {kb_id}")
+    db = _get_firestore_client()
+    db.collection("knowledge_bases").document(kb_id).set({
+        "title": title or kb_id,
+        "updated_at": datetime.now(timezone.utc),
+    }, merge=True)
+    return knowledge_base_key(kb_id)
+
+
+def knowledge_base_exists(kb_id):
+    db = _get_firestore_client()
+    return db.collection("knowledge_bases").document(kb_id).get().exists
+
+
+def get_subscriptions(user_id):
+    """Danh sách kb_id mà chat đã đăng ký (cache SUBSCRIPTION_CACHE_TTL giây)."""
+    user_id = str(user_id)
+    with _subscriptions_lock:
+        entry = _subscriptions.get(user_id)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    try:
+        db = _get_firestore_client()
+        kb_ids = tuple(sorted(doc.id for doc in _subscriptions_collection(db, user_id).stream()))
+    except Exception as e:
+        logger.error(f"Lỗi khi đọc danh sách đăng ký của user {user_id}: {str(e)}")
+        # Dùng lại danh sách cũ (nếu có) thay vì bỏ qua các kho đã đăng ký
+        return entry[0] if entry is not None else ()
+    with _subscriptions_lock:
+        _subscriptions[user_id] = (kb_ids, time.monotonic() + SUBSCRIPTION_CACHE_TTL)
+    return kb_ids
+
+
+def _invalidate(user_id):
+    with _subscriptions_lock:
+        _subscriptions.pop(str(user_id), None)
+
+
+def search_namespaces(user_id):
+    """Các khóa chỉ mục cần tìm cho một chat: dữ liệu riêng trước, sau đó các kho đã đăng ký."""
+    return [str(user_id)] + [knowledge_base_key(kb_id) for kb_id in get_subscriptions(user_id)]
+
+
+def subscribe(user_id, kb_id):
+    """Đăng ký kho kiến thức cho chat; trả về (thành công, thông báo)."""
+    try:
+        if not is_valid_kb_id(kb_id):
+            return False, "Mã kho kiến thức không hợp lệ (chỉ gồm chữ thường, số và _)."
+        subscriptions = get_subscriptions(user_id)
+        if kb_id in subscriptions:
+            return True, f"Bạn đã đăng ký kho kiến thức {kb_id}."
+        if len(subscriptions) >= MAX_SUBSCRIPTIONS:
+            return False, f"Chỉ được đăng ký tối đa {MAX_SUBSCRIPTIONS} kho kiến thức."
+        if not knowledge_base_exists(kb_id):
+            return False, f"Không tìm thấy kho kiến thức {kb_id}."
+        db = _get_firestore_client()
+        _subscriptions_collection(db, user_id).document(kb_id).set({"subscribed_at": datetime.now(timezone.utc)})
+        _invalidate(user_id)
+        logger.info(f"User {user_id} đăng ký kho kiến thức {kb_id}")
+        return True, f"Đã đăng ký kho kiến thức {kb_id}."
+    except Exception as e:
+        logger.error(f"Error subscribing user {user_id} to {kb_id}: {str(e)}")
+        return False, f"Lỗi khi đăng ký: {str(e)}"
+
+
+def unsubscribe(user_id, kb_id):
+    """Hủy đăng ký kho kiến thức; trả về (thành công, thông báo)."""
+    try:
+        if kb_id not in get_subscriptions(user_id):
+            return False, f"Bạn chưa đăng ký kho kiến thức {kb_id}."
+        db = _get_firestore_client()
+        _subscriptions_collection(db, user_id).document(kb_id).delete()
+        _invalidate(user_id)
+        logger.info(f"User {user_id} hủy đăng ký kho kiến thức {kb_id}")
+        return True, f"Đã hủy đăng ký kho kiến thức {kb_id}."
+    except Exception as e:
+        logger.error(f"Error unsubscribing user {user_id} from {kb_id}: {str(e)}")
+        return False, f"Lỗi khi hủy đăng ký: {str(e)}"
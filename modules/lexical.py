@@ -0,0 +1,100 @@
+# lexical.py
+import re
+import sys
+import math
+from array import array
+from collections import Counter
+import numpy as np
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+# Phần cố định của một từ trong _postings: hai array rỗng + tuple + ô của dict
+_TERM_OVERHEAD = 2 * sys.getsizeof(array("i")) + sys.getsizeof((None, None)) + 32
+
+
+def tokenize(text):
+    """Tách từ trên văn bản đã qua clean_input (chữ thường, giữ chữ số và mã)."""
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+class BM25Index:
+    """Chỉ mục đảo BM25 cập nhật tăng dần; posting list lưu bằng array để đọc bằng np.frombuffer."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> (array doc_id, array tf)
+        self._doc_len = array("i")
+        self._total_len = 0
+        # Ước lượng bộ nhớ, cộng dồn khi thêm tài liệu để nbytes không phải duyệt _postings
+        self._terms_nbytes = 0
+        self._postings_count = 0
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    @property
+    def nbytes(self):
+        """Ước lượng bộ nhớ của posting list, từ điển từ và độ dài tài liệu."""
+        itemsize = self._doc_len.itemsize
+        return self._terms_nbytes + 2 * itemsize * self._postings_count + itemsize * len(self._doc_len)
+
+    def add(self, text):
+        """Thêm tài liệu; id là thứ tự thêm vào (khớp với vị trí bản ghi trong UserIndex)."""
+        doc_id = len(self._doc_len)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("i"), array("i"))
+                self._terms_nbytes += sys.getsizeof(term) + _TERM_OVERHEAD
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+        self._postings_count += len(terms)
+        length = sum(terms.values())
+        self._doc_len.append(length)
+        self._total_len += length
+        return doc_id
+
+    def search(self, query, k):
+        """Trả về (ids, scores, coverage) của k tài liệu có điểm BM25 cao nhất.
+
+        coverage là tỉ lệ IDF của các từ trong câu hỏi có xuất hiện trong tài liệu, để các âm tiết
+        phổ biến ("hôm", "nay", "là"...) gần như không được tính.
+        """
+        n = len(self._doc_len)
+        terms = set(tokenize(query))
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        if not n or not terms or k <= 0:
+            return empty
+        doc_len = np.frombuffer(self._doc_len, dtype=np.int32)[:n]
+        norm = self.k1 * (1 - self.b + self.b * doc_len / (self._total_len / n))
+        scores = np.zeros(n, dtype=np.float32)
+        matched = np.zeros(n, dtype=np.float32)
+        total_idf = 0.0
+        for term in terms:
+            postings = self._postings.get(term)
+            df = len(postings[0]) if postings is not None else 0
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            total_idf += idf
+            if postings is None:
+                continue
+            ids = np.frombuffer(postings[0], dtype=np.int32)
+            tf = np.frombuffer(postings[1], dtype=np.int32).astype(np.float32)
+            scores[ids] += idf * tf * (self.k1 + 1) / (tf + norm[ids])
+            matched[ids] += idf
+        hits = np.flatnonzero(matched)
+        if not len(hits):
+            return empty
+        if k < len(hits):
+            hits = hits[np.argpartition(scores[hits], -k)[-k:]]
+        hits = hits[np.argsort(scores[hits])[::-1]]
+        return hits, scores[hits], matched[hits] / total_idf
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Gộp nhiều danh sách id đã xếp hạng: điểm = tổng 1 / (k + hạng)."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
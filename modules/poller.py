@@ -0,0 +1,80 @@
+# poller.py
+import os
+import logging
+import threading
+from telegram.error import Conflict, RetryAfter, TimedOut
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# Telegram trả tối đa 100 update mỗi lần getUpdates
+POLL_LIMIT = max(1, min(int(os.getenv("POLL_LIMIT", 100)), 100))
+# Thời gian long polling (giây) Telegram giữ kết nối khi chưa có update
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", 30))
+POLL_MAX_BACKOFF = float(os.getenv("POLL_MAX_BACKOFF", 30))
+
+
+class Poller:
+    """Lấy update bằng getUpdates theo lô và chuyển từng update cho `dispatch`.
+
+    offset chỉ tăng sau khi update đã được đưa vào hàng đợi, nên update chưa nhận
+    sẽ được Telegram trả lại ở lần gọi sau.
+    """
+
+    def __init__(self, bot, dispatch, limit=POLL_LIMIT, timeout=POLL_TIMEOUT, allowed_updates=("message",)):
+        self.bot = bot
+        self.dispatch = dispatch
+        self.limit = limit
+        self.timeout = timeout
+        self.allowed_updates = list(allowed_updates)
+        self.offset = None
+        self._stop = threading.Event()
+
+    def poll_once(self):
+        """Một lần getUpdates; trả về số update đã được nhận."""
+        updates = self.bot.get_updates(
+            offset=self.offset,
+            limit=self.limit,
+            timeout=self.timeout,
+            allowed_updates=self.allowed_updates,
+        )
+        dispatched = 0
+        for update in updates:
+            if self.dispatch(update) is False:
+                break  # Không nhận được: giữ offset để lấy lại update này ở lần sau
+            self.offset = update.update_id + 1
+            dispatched += 1
+        if updates:
+            metrics.inc("poller_updates_total", dispatched)
+            metrics.observe("poller_batch_size", len(updates), buckets=(1, 5, 10, 25, 50, 100))
+        return dispatched
+
+    def run(self):
+        """Vòng lặp polling cho đến khi stop() được gọi."""
+        # getUpdates không hoạt động khi webhook đang bật
+        self.bot.delete_webhook()
+        logger.info(f"Bắt đầu long polling (limit={self.limit}, timeout={self.timeout}s)")
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+                backoff = 1.0
+            except RetryAfter as e:
+                logger.warning(f"getUpdates bị giới hạn, chờ {e.retry_after}s")
+                self._stop.wait(e.retry_after)
+            except TimedOut:
+                continue  # Long polling hết thời gian mà chưa có update
+            except Conflict as e:
+                logger.error(f"getUpdates xung đột (webhook hoặc poller khác đang chạy): {str(e)}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, POLL_MAX_BACKOFF)
+            except Exception as e:
+                metrics.inc("poller_errors_total")
+                logger.warning(f"Lỗi khi getUpdates, thử lại sau {backoff:.0f}s: {str(e)}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, POLL_MAX_BACKOFF)
+        logger.info("Đã dừng long polling")
+
+    def stop(self):
+        self._stop.set()
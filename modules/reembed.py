@@ -0,0 +1,173 @@
+# reembed.py
+"""Nhúng lại toàn bộ trained_data bằng một mô hình khác (có thể tiếp tục sau khi dừng).
+
+    python -m modules.reembed --model paraphrase-multilingual-MiniLM-L12-v2 --checkpoint reembed.json
+
+Sau khi chạy xong, đặt EMBEDDING_MODEL trùng với --model và khởi động lại bot
+để các chỉ mục trong bộ nhớ được nạp lại.
+
+Với --convert-only, job không chạy mô hình mà chỉ chuyển các embedding dạng danh sách số
+cũ sang dạng bytes gọn theo EMBEDDING_FORMAT.
+"""
+import os
+import json
+import argparse
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from modules.storage import _get_firestore_client, FIRESTORE_BATCH_LIMIT, knowledge_base_key, trained_data_collection, touch_user_data
+from utils.vectors import encode_vector
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Lưu tiến độ: các user đã xong và document cuối cùng đã xử lý của từng user."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = set()
+        self.cursors = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.done = set(state.get("done", []))
+            self.cursors = state.get("cursors", {})
+            logger.info(f"Tiếp tục từ checkpoint: {len(self.done)} user đã xong")
+
+    def _write(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"done": sorted(self.done), "cursors": self.cursors}, f)
+        os.replace(tmp_path, self.path)
+
+    def advance(self, user_id, doc_id):
+        with self._lock:
+            self.cursors[user_id] = doc_id
+            self._write()
+
+    def finish(self, user_id):
+        with self._lock:
+            self.done.add(user_id)
+            self.cursors.pop(user_id, None)
+            self._write()
+
+
+class Reembedder:
+    def __init__(self, model_name, checkpoint, page_size=200, force=False, convert_only=False):
+        self.model_name = model_name
+        self.convert_only = convert_only
+        if convert_only:
+            self.model = None
+        else:
+            from sentence_transformers import SentenceTransformer
+            self.model = SentenceTransformer(model_name)
+        self.checkpoint = checkpoint
+        self.page_size = min(page_size, FIRESTORE_BATCH_LIMIT)
+        self.force = force
+        self.db = _get_firestore_client()
+        # Đọc Firestore song song giữa các user, nhưng chỉ một luồng dùng mô hình tại một thời điểm
+        self._model_lock = threading.Lock()
+
+    def _pages(self, collection, cursor):
+        query = collection.order_by("__name__").limit(self.page_size)
+        if cursor:
+            query = query.start_after(collection.document(cursor).get())
+        while True:
+            docs = list(query.stream())
+            if not docs:
+                return
+            yield docs
+            if len(docs) < self.page_size:
+                return
+            query = collection.order_by("__name__").limit(self.page_size).start_after(docs[-1])
+
+    def reembed_user(self, user_id):
+        collection = trained_data_collection(self.db, user_id)
+        updated = 0
+        for docs in self._pages(collection, self.checkpoint.cursors.get(user_id)):
+            pending = []
+            for doc in docs:
+                data = doc.to_dict()
+                if self.convert_only:
+                    if data.get("embedding"):
+                        pending.append((doc.reference, np.asarray(data["embedding"], dtype=np.float32)))
+                    continue
+                if not data.get("content"):
+                    continue
+                if not self.force and data.get("embedding_model") == self.model_name and data.get("embedding_bytes"):
+                    continue
+                pending.append((doc.reference, data["content"]))
+            if pending:
+                if self.convert_only:
+                    vectors = [vector for _, vector in pending]
+                else:
+                    with self._model_lock:
+                        vectors = self.model.encode([content for _, content in pending], convert_to_numpy=True)
+                from google.cloud import firestore
+                batch = self.db.batch()
+                for (reference, _), vector in zip(pending, vectors):
+                    fields = {**encode_vector(vector), "embedding": firestore.DELETE_FIELD}
+                    if not self.convert_only:
+                        fields["embedding_model"] = self.model_name
+                    batch.update(reference, fields)
+                batch.commit()
+                updated += len(pending)
+            self.checkpoint.advance(user_id, docs[-1].id)
+        self.checkpoint.finish(user_id)
+        if updated:
+            # Snapshot chỉ mục trên đĩa vẫn chứa vector cũ
+            from modules.index import invalidate_user_index
+            invalidate_user_index(user_id)
+            touch_user_data(user_id)
+        logger.info(f"User {user_id}: đã nhúng lại {updated} bản ghi")
+        return updated
+
+    def run(self, user_ids=None, workers=4):
+        if not user_ids:
+            user_ids = [doc.id for doc in self.db.collection("users").list_documents()]
+            user_ids += [knowledge_base_key(doc.id) for doc in self.db.collection("knowledge_bases").list_documents()]
+        user_ids = [user_id for user_id in user_ids if user_id not in self.checkpoint.done]
+        logger.info(f"Xử lý dữ liệu của {len(user_ids)} user ({'chuyển định dạng' if self.convert_only else 'mô hình ' + str(self.model_name)})")
+        total = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self.reembed_user, user_id): user_id for user_id in user_ids}
+            for future in as_completed(futures):
+                try:
+                    total += future.result()
+                except Exception as e:
+                    logger.error(f"Lỗi khi nhúng lại dữ liệu user {futures[future]}: {str(e)}", exc_info=True)
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nhúng lại trained_data bằng mô hình mới.")
+    parser.add_argument("--model", help="tên mô hình sentence-transformers")
+    parser.add_argument("--convert-only", action="store_true", help="chỉ chuyển embedding cũ sang dạng bytes gọn")
+    parser.add_argument("--checkpoint", default="reembed_checkpoint.json", help="file lưu tiến độ")
+    parser.add_argument("--users", nargs="*", help="chỉ xử lý các user này (kho kiến thức dùng chung: kb_<id>)")
+    parser.add_argument("--workers", type=int, default=4, help="số user đọc song song")
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--force", action="store_true", help="nhúng lại cả bản ghi đã dùng mô hình này")
+    args = parser.parse_args()
+    if not args.model and not args.convert_only:
+        parser.error("cần --model hoặc --convert-only")
+
+    reembedder = Reembedder(
+        args.model,
+        Checkpoint(args.checkpoint),
+        page_size=args.page_size,
+        force=args.force,
+        convert_only=args.convert_only,
+    )
+    total = reembedder.run(args.users, workers=args.workers)
+    print(f"Đã nhúng lại {total} bản ghi")
+
+
+if __name__ == "__main__":
+    main()
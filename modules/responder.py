@@ -1,71 +1,235 @@
 # responder.py
 import os
+import json
+import time
+import threading
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import logging
 from modules.storage import save_to_chat_history
+from modules.embedder import encode_one
+from modules.response_cache import get_cached_response, cache_response
+from utils.cleaner import clean_input
+from utils import metrics
+from utils.tracing import span, sampled
+from utils.circuit import CircuitBreaker
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-def generate_response(user_id, query, data):
-    """Tạo phản hồi dựa trên dữ liệu huấn luyện hoặc Gemini-1.5-Flash."""
+# "snippets": ghép các đoạn dữ liệu huấn luyện thành câu trả lời
+# "grounded": gửi các đoạn dữ liệu làm ngữ cảnh cho Gemini
+RESPONDER_MODE = os.getenv("RESPONDER_MODE", "snippets")
+SNIPPET_CHARS = int(os.getenv("RESPONDER_SNIPPET_CHARS", 200))
+
+GEMINI_URL = os.getenv(
+    "GEMINI_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent",
+)
+# streamGenerateContent trả từng phần câu trả lời (SSE) để gửi dần lên Telegram
+GEMINI_STREAM = os.getenv("GEMINI_STREAM", "0") == "1"
+GEMINI_STREAM_URL = os.getenv("GEMINI_STREAM_URL", GEMINI_URL.replace(":generateContent", ":streamGenerateContent"))
+# Khi stream, câu trả lời dài không làm người dùng chờ lâu hơn nên có thể đặt cao hơn
+GEMINI_MAX_OUTPUT_TOKENS = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", 800 if GEMINI_STREAM else 200))
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", 3.05))
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", 10))
+# Số kết nối giữ sẵn bằng số worker xử lý update để không luồng nào phải chờ kết nối
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", os.getenv("UPDATE_WORKERS", 4)))
+
+# Thay cho việc thử kết nối google.com trước mỗi lần gọi
+_gemini_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("GEMINI_BREAKER_FAILURES", 5)),
+    reset_timeout=float(os.getenv("GEMINI_BREAKER_RESET", 30)),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+def _get_session():
+    """Session dùng chung (keep-alive) cho mọi lần gọi Gemini."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GEMINI_POOL_SIZE, max_retries=retries)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                _session = session
+    return _session
+
+def _post_gemini(url, payload, api_key, stream=False):
+    """Gửi request tới Gemini, ghi độ trễ và cập nhật trạng thái ngắt mạch.
+
+    stream=True trả về ngay khi nhận header; nội dung đọc dần qua _read_stream.
+    """
+    started = time.perf_counter()
+    status = "error"
+    params = {"key": api_key, "alt": "sse"} if stream else {"key": api_key}
+    try:
+        response = _get_session().post(
+            url,
+            params=params,
+            json=payload,
+            timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT),
+            stream=stream,
+        )
+        status = str(response.status_code)
+        if response.status_code == 429 or response.status_code >= 500:
+            _gemini_breaker.record_failure()
+        else:
+            _gemini_breaker.record_success()
+        return response
+    except requests.exceptions.RequestException:
+        _gemini_breaker.record_failure()
+        raise
+    finally:
+        metrics.observe("gemini_request_seconds", time.perf_counter() - started, status=status)
+
+def _candidate_text(body):
+    parts = (body.get("candidates") or [{}])[0].get("content", {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+def _read_stream(response, on_partial):
+    """Đọc các sự kiện SSE của streamGenerateContent, gọi on_partial với phần văn bản đã nhận."""
+    started = time.perf_counter()
+    text = ""
+    # SSE luôn là UTF-8; requests mặc định ISO-8859-1 khi header không có charset
+    response.encoding = "utf-8"
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            try:
+                chunk = _candidate_text(json.loads(line[5:]))
+            except ValueError:
+                logger.warning(f"Bỏ qua sự kiện stream không hợp lệ từ Gemini: {line[:200]}")
+                continue
+            if not chunk:
+                continue
+            if not text:
+                metrics.observe("gemini_first_token_seconds", time.perf_counter() - started)
+            text += chunk
+            on_partial(f"[Gemini] {text}")
+    finally:
+        response.close()
+    return text
+
+def _as_matches(data):
+    """Chấp nhận một bản ghi đơn hoặc danh sách (bản ghi, điểm) từ retriever."""
+    if not data:
+        return []
+    if isinstance(data, dict):
+        return [(data, None)]
+    return list(data)
+
+def _merge_snippets(matches):
+    """Ghép nhiều đoạn dữ liệu huấn luyện thành một phản hồi."""
+    if len(matches) == 1:
+        return f"Dựa trên thông tin bạn cung cấp: {matches[0][0]['content'][:SNIPPET_CHARS]}..."
+    lines = [f"- {record['content'][:SNIPPET_CHARS]}..." for record, _ in matches]
+    return "Dựa trên thông tin bạn cung cấp:\n" + "\n".join(lines)
+
+def _build_prompt(user_id, query, matches):
+    prompt = f"User ID: {user_id}\nQuery: {query}\n"
+    if matches:
+        context = "\n".join(f"[{i + 1}] {record['content']}" for i, (record, _) in enumerate(matches))
+        prompt += (
+            f"Context:\n{context}\n"
+            "Instruction: Answer naturally in Vietnamese using only the context above when it is relevant."
+        )
+    else:
+        prompt += "Instruction: Answer naturally in Vietnamese."
+    return prompt
+
+def generate_response(user_id, query, data, query_embedding=None, on_partial=None):
+    """Tạo phản hồi dựa trên dữ liệu huấn luyện hoặc Gemini-1.5-Flash.
+
+    Khi bật GEMINI_STREAM và có on_partial, on_partial("") được gọi lúc bắt đầu gọi Gemini,
+    sau đó với toàn bộ văn bản đã nhận mỗi khi có thêm một phần câu trả lời.
+    """
     try:
+        matches = _as_matches(data)
+
         # Xử lý dữ liệu huấn luyện
-        if data:
-            # Trả về dữ liệu huấn luyện nếu tìm thấy bản ghi liên quan
-            response = f"Dựa trên thông tin bạn cung cấp: {data['content'][:200]}..."
+        if matches and RESPONDER_MODE != "grounded":
+            # Trả về dữ liệu huấn luyện nếu tìm thấy các bản ghi liên quan
+            response = _merge_snippets(matches)
             save_to_chat_history(user_id, query, response)
-            logger.info(f"Generated response from Firestore for user {user_id}")
+            logger.debug("Generated response from Firestore for user %s (%d snippets)", user_id, len(matches))
             return response
 
-        # Nếu không có dữ liệu liên quan, gọi Gemini
-        # Kiểm tra kết nối mạng
-        try:
-            test_response = requests.get("https://www.google.com", timeout=5)
-            logger.info(f"Test connection to Google: {test_response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error: {str(e)}")
-            error_msg = "Không thể kết nối đến mạng. Vui lòng kiểm tra kết nối của bạn."
-            save_to_chat_history(user_id, query, error_msg)
-            return error_msg
-
+        # Nếu không có dữ liệu liên quan (hoặc ở chế độ grounded), gọi Gemini
         # Kiểm tra GEMINI_API_KEY
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             logger.error("GEMINI_API_KEY is not set")
+            if matches:
+                response = _merge_snippets(matches)
+                save_to_chat_history(user_id, query, response)
+                return response
             response = "Tôi chưa có đủ thông tin để trả lời câu hỏi này. Bạn có thể dùng /train text=... hoặc /train url=... để dạy tôi nhé! Ví dụ: /train text=Nha Trang có nhiều bãi biển đẹp."
             save_to_chat_history(user_id, query, response)
             logger.info(f"Sent default response for user {user_id} due to missing API key")
             return response
 
-        # Cấu hình retry cho requests
-        session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504])
-        session.mount("https://", HTTPAdapter(max_retries=retries))
+        # Câu hỏi tương tự đã được Gemini trả lời: dùng lại câu trả lời (chỉ khi không có ngữ cảnh riêng)
+        if not matches:
+            if query_embedding is None:
+                # Thường trúng cache embedding vì retriever vừa nhúng cùng câu hỏi
+                query_embedding = encode_one(clean_input(query))
+            cached = get_cached_response(user_id, query_embedding)
+            if cached is not None:
+                save_to_chat_history(user_id, query, cached)
+                logger.debug("Served cached Gemini response for user %s", user_id)
+                return cached
+
+        # Mạch đang ngắt: trả lời ngay thay vì chờ timeout
+        if not _gemini_breaker.allow():
+            logger.warning(f"Gemini circuit open, skipping request for user {user_id}")
+            if matches:
+                response = _merge_snippets(matches)
+            else:
+                response = "Hệ thống AI tạm thời không khả dụng, vui lòng thử lại sau."
+            save_to_chat_history(user_id, query, response)
+            return response
 
         # Gọi Gemini-1.5-Flash API
-        gemini_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
-        headers = {"Content-Type": "application/json"}
         payload = {
             "contents": [{
                 "parts": [{
-                    "text": f"User ID: {user_id}\nQuery: {query}\nInstruction: Answer naturally in Vietnamese."
+                    "text": _build_prompt(user_id, query, matches)
                 }]
             }],
             "generationConfig": {
-                "maxOutputTokens": 200
+                "maxOutputTokens": GEMINI_MAX_OUTPUT_TOKENS
             }
         }
         
-        logger.info(f"Sending Gemini request for user {user_id}: {query}")
-        response = session.post(gemini_url, json=payload, headers=headers, timeout=5)
-        logger.info(f"Gemini response status: {response.status_code}, body: {response.text}")
+        stream = GEMINI_STREAM and on_partial is not None
+        logger.debug("Sending Gemini request for user %s (stream=%s)", user_id, stream)
+        with span("gemini"):
+            if stream:
+                on_partial("")
+                response = _post_gemini(GEMINI_STREAM_URL, payload, api_key, stream=True)
+            else:
+                response = _post_gemini(GEMINI_URL, payload, api_key)
+            text = None
+            if response.status_code == 200:
+                text = _read_stream(response, on_partial) if stream else _candidate_text(response.json())
+        if sampled():
+            logger.info("Gemini response status=%s user=%s stream=%s", response.status_code, user_id, stream)
+        # Nội dung câu trả lời chỉ ghi ở DEBUG và cắt ngắn
+        logger.debug("Gemini response text: %.500s", text)
 
         if response.status_code == 200:
-            text = response.json().get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "Không có phản hồi từ Gemini.")
+            text = text or "Không có phản hồi từ Gemini."
             full_response = f"[Gemini] {text}"
+            if not matches:
+                cache_response(user_id, query_embedding, full_response)
             save_to_chat_history(user_id, query, full_response)
             return full_response
         
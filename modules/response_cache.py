@@ -0,0 +1,173 @@
+# response_cache.py
+import os
+import json
+import time
+import threading
+import logging
+import numpy as np
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.92))
+# "user": mỗi người dùng một vùng cache; "global": dùng chung cho mọi người dùng
+RESPONSE_CACHE_SCOPE = os.getenv("RESPONSE_CACHE_SCOPE", "user")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+# Đường dẫn file .npz để giữ cache qua các lần khởi động lại (bỏ trống = không lưu)
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+
+
+class SemanticCache:
+    """Cache câu trả lời theo embedding câu hỏi; trúng khi cosine similarity vượt ngưỡng."""
+
+    def __init__(self, capacity, threshold, ttl):
+        # capacity <= 0 tắt cache (get luôn trượt, put không làm gì)
+        capacity = max(capacity, 0)
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors = None  # (capacity, dim) float32, các dòng đã chuẩn hóa
+        self._expires = np.zeros(capacity, dtype=np.float64)  # 0 = ô trống
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._scope_ids = np.full(capacity, -1, dtype=np.int64)
+        self._answers = [None] * capacity
+        # scope <-> id; mỗi scope còn trong bảng đều đang giữ ít nhất một ô nên số scope <= capacity
+        self._scopes = {}
+        self._scope_names = {}
+        self._next_scope_id = 0
+
+    def _scope_id(self, scope, create=False):
+        scope_id = self._scopes.get(scope)
+        if scope_id is None and create:
+            scope_id = self._scopes[scope] = self._next_scope_id
+            self._scope_names[scope_id] = scope
+            self._next_scope_id += 1
+        return scope_id
+
+    def _release_scope(self, scope_id):
+        """Bỏ scope khỏi bảng khi ô cuối cùng của nó bị thay bằng câu trả lời khác."""
+        if scope_id >= 0 and not (self._scope_ids == scope_id).any():
+            self._scopes.pop(self._scope_names.pop(scope_id), None)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, scope, vector):
+        """Trả về câu trả lời đã cache gần nhất với câu hỏi, hoặc None."""
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            scope_id = self._scope_id(scope)
+            if scope_id is None or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                return None
+            valid = (self._scope_ids == scope_id) & (self._expires > now)
+            if not valid.any():
+                return None
+            scores = np.where(valid, self._vectors @ query, -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._last_used[best] = now
+            return self._answers[best]
+
+    def put(self, scope, vector, answer, expires=None):
+        if self.capacity <= 0:
+            return
+        vector = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._expires[:] = 0
+                self._scope_ids[:] = -1
+                self._scopes.clear()
+                self._scope_names.clear()
+            # Ưu tiên ô trống/hết hạn, nếu không thì thay ô ít được dùng gần đây nhất
+            expired = np.flatnonzero(self._expires <= now)
+            slot = int(expired[0]) if len(expired) else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._expires[slot] = now + self.ttl if expires is None else expires
+            self._last_used[slot] = now
+            previous = int(self._scope_ids[slot])
+            self._scope_ids[slot] = self._scope_id(scope, create=True)
+            self._answers[slot] = answer
+            if previous != self._scope_ids[slot]:
+                self._release_scope(previous)
+
+    def __len__(self):
+        with self._lock:
+            return int((self._expires > time.time()).sum())
+
+    def save(self, path):
+        """Ghi các mục còn hạn ra file .npz."""
+        with self._lock:
+            if self._vectors is None:
+                return
+            live = np.flatnonzero(self._expires > time.time())
+            scopes = self._scope_names
+            meta = json.dumps({
+                "answers": [self._answers[i] for i in live],
+                "scopes": [scopes[int(self._scope_ids[i])] for i in live],
+            }, ensure_ascii=False)
+            vectors = self._vectors[live]
+            expires = self._expires[live]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, vectors=vectors, expires=expires, meta=np.array(meta))
+        os.replace(tmp_path, path)
+        logger.info(f"Đã lưu {len(live)} câu trả lời vào {path}")
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            vectors, expires = data["vectors"], data["expires"]
+            meta = json.loads(str(data["meta"]))
+        now = time.time()
+        count = 0
+        for vector, expire, scope, answer in zip(vectors, expires, meta["scopes"], meta["answers"]):
+            if expire > now and count < self.capacity:
+                self.put(scope, vector, answer, expires=float(expire))
+                count += 1
+        logger.info(f"Đã nạp {count} câu trả lời từ {path}")
+
+
+_cache = SemanticCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_TTL)
+
+if RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_PATH and os.path.exists(RESPONSE_CACHE_PATH):
+    try:
+        _cache.load(RESPONSE_CACHE_PATH)
+    except Exception as e:
+        logger.error(f"Không thể nạp cache câu trả lời: {str(e)}")
+
+
+def _scope(user_id):
+    return "*" if RESPONSE_CACHE_SCOPE == "global" else str(user_id)
+
+
+def get_cached_response(user_id, query_embedding):
+    """Tìm câu trả lời đã cache cho câu hỏi tương tự."""
+    if not RESPONSE_CACHE_ENABLED or query_embedding is None:
+        return None
+    answer = _cache.get(_scope(user_id), query_embedding)
+    metrics.inc("response_cache_hits_total" if answer is not None else "response_cache_misses_total")
+    return answer
+
+
+def cache_response(user_id, query_embedding, answer):
+    if RESPONSE_CACHE_ENABLED and query_embedding is not None:
+        _cache.put(_scope(user_id), query_embedding, answer)
+
+
+def save_response_cache():
+    """Lưu cache ra đĩa (gọi khi tắt tiến trình)."""
+    if RESPONSE_CACHE_ENABLED and RESPONSE_CACHE_PATH:
+        try:
+            _cache.save(RESPONSE_CACHE_PATH)
+        except Exception as e:
+            logger.error(f"Không thể lưu cache câu trả lời: {str(e)}")
@@ -1,52 +1,138 @@
 # retriever.py
-from modules.storage import get_user_data
+from modules.index import get_user_index
+from modules.knowledge import search_namespaces
 from utils.cleaner import clean_input
-from sentence_transformers import SentenceTransformer, util
+from modules.embedder import encode_one
+from modules.lexical import tokenize, reciprocal_rank_fusion
+from utils import metrics
+from utils.tracing import span
+import os
+import time
 import logging
-import numpy as np
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-# Khởi tạo mô hình nhẹ
-model = SentenceTransformer('paraphrase-MiniLM-L3-v2')
+# Số bản ghi tối đa và ngưỡng cosine similarity, cấu hình theo từng triển khai
+RETRIEVER_TOP_K = int(os.getenv("RETRIEVER_TOP_K", 3))
+RETRIEVER_THRESHOLD = float(os.getenv("RETRIEVER_THRESHOLD", 0.5))
 
-def retrieve_data(user_id, query):
-    """Tìm dữ liệu huấn luyện phù hợp với câu hỏi bằng semantic search."""
+# "semantic": chỉ dùng embedding; "hybrid": gộp BM25 và embedding bằng reciprocal rank fusion
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "semantic")
+# Số ứng viên lấy từ mỗi nguồn trước khi gộp
+RETRIEVER_CANDIDATES = int(os.getenv("RETRIEVER_CANDIDATES", 20))
+# Tỉ lệ IDF của các từ trong câu hỏi tối thiểu phải xuất hiện để kết quả BM25 được tính là liên quan
+LEXICAL_MIN_COVERAGE = float(os.getenv("LEXICAL_MIN_COVERAGE", 0.5))
+# Bỏ qua bước nhúng khi kết quả BM25 đầu tiên đủ độ phủ và có điểm vượt xa kết quả thứ hai
+# (thường là khi câu hỏi chứa một tên riêng, mã số hay con số chỉ có trong một bản ghi);
+# khi đó điểm trả về là độ phủ thay vì cosine
+LEXICAL_SKIP_MARGIN = float(os.getenv("LEXICAL_SKIP_MARGIN", 1.5))
+# Kết quả chỉ có từ BM25 (cosine dưới RETRIEVER_THRESHOLD) vẫn phải đạt cosine tối thiểu này
+LEXICAL_MIN_COSINE = float(os.getenv("LEXICAL_MIN_COSINE", 0.3))
+
+def _encode(cleaned_query):
+    with span("retrieve.encode"):
+        return encode_one(cleaned_query)
+
+def _semantic(index, cleaned_query, k, threshold, query_embedding=None):
+    if query_embedding is None:
+        query_embedding = _encode(cleaned_query)
+    with span("retrieve.semantic"):
+        return index.semantic_top_k(query_embedding, k, threshold)
+
+def _with_cosine(fused, cosine, k, threshold):
+    """Giữ thứ tự RRF nhưng trả về cosine làm điểm; bỏ kết quả có cosine quá thấp."""
+    floor = min(threshold, LEXICAL_MIN_COSINE)
+    ranked = []
+    for key, _ in fused:
+        score = float(cosine(key))
+        if score >= floor:
+            ranked.append((key, score))
+            if len(ranked) == k:
+                break
+    return ranked
+
+def _is_strong_lexical(lexical, term_count):
+    if term_count < 2 or not lexical or lexical[0][2] < LEXICAL_MIN_COVERAGE:
+        return False
+    return len(lexical) == 1 or lexical[0][1] >= LEXICAL_SKIP_MARGIN * lexical[1][1]
+
+def _hybrid(index, cleaned_query, k, threshold):
+    with span("retrieve.lexical"):
+        lexical = index.lexical_top_k(cleaned_query, RETRIEVER_CANDIDATES)
+    lexical_hits = [i for i, _, coverage in lexical if coverage >= LEXICAL_MIN_COVERAGE]
+    if _is_strong_lexical(lexical, len(set(tokenize(cleaned_query)))):
+        metrics.inc("retriever_lexical_shortcut_total")
+        return [(i, coverage) for i, _, coverage in lexical[:k] if coverage >= LEXICAL_MIN_COVERAGE], "lexical"
+    query_embedding = _encode(cleaned_query)
+    semantic = _semantic(index, cleaned_query, RETRIEVER_CANDIDATES, threshold, query_embedding)
+    fused = reciprocal_rank_fusion([[i for i, _ in semantic], lexical_hits])
+    return _with_cosine(fused, lambda i: index.cosine(query_embedding, [i])[0], k, threshold), "hybrid"
+
+def _merged(indexes, cleaned_query, k, threshold):
+    """Xếp hạng chung trên nhiều chỉ mục (dữ liệu riêng và các kho kiến thức đã đăng ký).
+
+    Câu hỏi chỉ được nhúng một lần; cosine so sánh được giữa các chỉ mục, còn điểm BM25 phụ
+    thuộc IDF của từng chỉ mục nên danh sách từ khóa được xếp theo độ phủ trước rồi mới gộp bằng RRF.
+    Kết quả là các cặp ((thứ tự chỉ mục, vị trí bản ghi), cosine).
+    """
+    query_embedding = _encode(cleaned_query)
+    semantic, lexical = [], []
+    for n, index in enumerate(indexes):
+        with span("retrieve.semantic"):
+            semantic += [((n, i), score) for i, score in index.semantic_top_k(query_embedding, RETRIEVER_CANDIDATES, threshold)]
+        if RETRIEVER_MODE == "hybrid":
+            with span("retrieve.lexical"):
+                lexical += [
+                    ((n, i), score, coverage) for i, score, coverage in index.lexical_top_k(cleaned_query, RETRIEVER_CANDIDATES)
+                    if coverage >= LEXICAL_MIN_COVERAGE
+                ]
+    semantic.sort(key=lambda item: item[1], reverse=True)
+    if RETRIEVER_MODE != "hybrid":
+        return semantic[:k], "semantic"
+    lexical.sort(key=lambda item: (item[2], item[1]), reverse=True)
+    fused = reciprocal_rank_fusion([[key for key, _ in semantic], [key for key, _, _ in lexical]])
+    return _with_cosine(fused, lambda key: indexes[key[0]].cosine(query_embedding, [key[1]])[0], k, threshold), "merged"
+
+def retrieve_data(user_id, query, k=None, threshold=None):
+    """Tìm các bản ghi huấn luyện phù hợp nhất, trả về danh sách (bản ghi, điểm) giảm dần.
+
+    Tìm trong dữ liệu riêng của chat và các kho kiến thức chat đã đăng ký.
+    """
+    k = RETRIEVER_TOP_K if k is None else k
+    threshold = RETRIEVER_THRESHOLD if threshold is None else threshold
     try:
         cleaned_query = clean_input(query)
-        data = get_user_data(user_id)
-        
-        if not data:
-            logger.info(f"No training data found for user {user_id}")
-            return None
+        with span("retrieve.index"):
+            indexes = [get_user_index(namespace) for namespace in search_namespaces(user_id)]
+            indexes = [index for index in indexes if len(index)]
         
-        # Nhúng câu hỏi
-        query_embedding = model.encode(cleaned_query, convert_to_tensor=False)
+        if not indexes:
+            logger.debug("No training data found for user %s", user_id)
+            return []
         
-        best_match = None
-        best_score = -1  # Cosine similarity từ -1 đến 1
-        
-        # Tìm bản ghi có mức độ tương đồng cao nhất
-        for item in data:
-            embedding = item.get("embedding", [])
-            if not embedding:
-                continue  # Bỏ qua nếu không có embedding
-            content_embedding = np.array(embedding)
-            score = util.cos_sim(query_embedding, content_embedding).item()
-            
-            if score > best_score:
-                best_score = score
-                best_match = item
-        
-        # Chỉ trả về nếu mức độ tương đồng đủ cao (> 0.5)
-        if best_score > 0.5:
-            logger.info(f"Found matching record for user {user_id}, query: {query}, similarity: {best_score}")
-            return best_match
+        started = time.perf_counter()
+        if len(indexes) > 1:
+            ranked, path = _merged(indexes, cleaned_query, k, threshold)
+            ranked = [(indexes[n].record(i), score) for (n, i), score in ranked]
+        else:
+            index = indexes[0]
+            if RETRIEVER_MODE == "hybrid":
+                ranked, path = _hybrid(index, cleaned_query, k, threshold)
+            else:
+                # Chỉ giữ các bản ghi có mức độ tương đồng vượt ngưỡng
+                ranked, path = _semantic(index, cleaned_query, k, threshold), "semantic"
+            ranked = [(index.record(i), score) for i, score in ranked]
+        metrics.observe("retrieval_seconds", time.perf_counter() - started, path=path)
+
+        matches = ranked
+        if matches:
+            logger.debug("Found %d matching records for user %s, best score: %.3f (%s)", len(matches), user_id, matches[0][1], path)
+            return matches
         
-        logger.info(f"No sufficiently relevant data found for user {user_id}, query: {query}")
-        return None
+        logger.debug("No sufficiently relevant data found for user %s", user_id)
+        return []
     
     except Exception as e:
         logger.error(f"Retriever error: {str(e)}")
-        return None
+        return []
@@ -0,0 +1,348 @@
+# sender.py
+import os
+import time
+import heapq
+import random
+import logging
+import threading
+from collections import deque
+from telegram.error import BadRequest, ChatMigrated, RetryAfter, Unauthorized
+from utils import metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+# Giới hạn của Telegram: ~30 tin/giây cho toàn bot, ~1 tin/giây cho mỗi chat
+TELEGRAM_MAX_LENGTH = 4096
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 2))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 5))
+SEND_BACKOFF_BASE = float(os.getenv("SEND_BACKOFF_BASE", 0.5))
+SEND_BACKOFF_MAX = float(os.getenv("SEND_BACKOFF_MAX", 30))
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", 5000))
+# Khoảng cách tối thiểu giữa hai lần sửa tin nhắn khi stream câu trả lời
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))
+STREAM_PLACEHOLDER = os.getenv("STREAM_PLACEHOLDER", "⏳ Đang trả lời...")
+
+_SEND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def split_message(text, limit=TELEGRAM_MAX_LENGTH):
+    """Chia văn bản thành các phần không quá `limit` ký tự, ưu tiên cắt ở xuống dòng rồi khoảng trắng."""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text:
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """Token bucket: `rate` token mỗi giây, tích lũy tối đa `burst` token (không tự khóa)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Số giây phải chờ để có một token (0 nếu có sẵn)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Message:
+    __slots__ = ("chat_id", "text", "attempt", "queued_at")
+
+    def __init__(self, chat_id, text):
+        self.chat_id = chat_id
+        self.text = text
+        self.attempt = 0
+        self.queued_at = time.monotonic()
+
+
+class Outbox:
+    """Hàng đợi gửi tin nhắn ở nền với giới hạn tốc độ toàn cục và theo từng chat.
+
+    Mỗi chat có hàng đợi riêng và chỉ một tin của chat được gửi tại một thời điểm, nên thứ
+    tự tin nhắn trong chat được giữ nguyên; heap `_ready` cho biết khi nào chat được gửi tiếp.
+    """
+
+    def __init__(self, bot, workers=SEND_WORKERS, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+                 chat_burst=SEND_CHAT_BURST, max_retries=SEND_MAX_RETRIES, queue_max=SEND_QUEUE_MAX):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.queue_max = queue_max
+        self._cond = threading.Condition()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._chats = {}  # chat_id -> deque[_Message] chưa gửi
+        self._ready = []  # heap (thời điểm được gửi, thứ tự, chat_id)
+        self._scheduled = set()  # chat đang nằm trong heap hoặc đang được gửi
+        self._seq = 0
+        self._size = 0
+        self._stopping = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def depth(self):
+        return self._size
+
+    def send(self, chat_id, text):
+        """Đưa tin nhắn vào hàng đợi (tự chia nếu quá dài); trả về False nếu hàng đợi đầy."""
+        parts = split_message(text or "")
+        with self._cond:
+            if self._stopping or self._size + len(parts) > self.queue_max:
+                metrics.inc("send_total", len(parts), status="dropped")
+                logger.warning(f"Hàng đợi gửi đầy, bỏ tin nhắn cho chat {chat_id}")
+                return False
+            self._chats.setdefault(chat_id, deque()).extend(_Message(chat_id, part) for part in parts)
+            self._size += len(parts)
+            if chat_id not in self._scheduled:
+                self._schedule(chat_id, time.monotonic())
+            metrics.set_gauge("send_queue_depth", self._size)
+            self._cond.notify()
+        return True
+
+    def acquire(self, chat_id, block=True):
+        """Lấy token cho một lệnh gọi trực tiếp tới Telegram (ví dụ sửa tin nhắn).
+
+        block=False trả về False ngay nếu phải chờ.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                bucket = self._bucket(chat_id)
+                delay = max(bucket.delay(now), self._global.delay(now))
+                if delay <= 0:
+                    bucket.take()
+                    self._global.take()
+                    return True
+                if not block:
+                    return False
+                self._cond.wait(delay)
+
+    def wait_idle(self, chat_id, timeout=None):
+        """Chờ đến khi các tin đang xếp hàng của chat đã được gửi; trả về False nếu hết thời gian."""
+        with self._cond:
+            return self._cond.wait_for(lambda: chat_id not in self._scheduled, timeout)
+
+    def _schedule(self, chat_id, ready_at):
+        self._seq += 1
+        heapq.heappush(self._ready, (ready_at, self._seq, chat_id))
+        self._scheduled.add(chat_id)
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: b for key, b in self._chat_buckets.items() if key in self._scheduled or not b.full(now)
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next(self):
+        """Chờ đến khi có tin được phép gửi; trả về None khi đã dừng và hết hàng đợi."""
+        with self._cond:
+            while True:
+                if self._stopping and not self._size:
+                    return None
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                now = time.monotonic()
+                ready_at, _, chat_id = self._ready[0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+                heapq.heappop(self._ready)
+                bucket = self._bucket(chat_id)
+                delay = max(bucket.delay(now), self._global.delay(now))
+                if delay > 0:
+                    self._schedule(chat_id, now + delay)
+                    continue
+                bucket.take()
+                self._global.take()
+                return self._chats[chat_id].popleft()
+
+    def _done(self, message, retry_at=None):
+        """Cập nhật hàng đợi sau một lần gửi; retry_at khác None thì gửi lại tin này vào lúc đó."""
+        chat_id = message.chat_id
+        with self._cond:
+            pending = self._chats[chat_id]
+            if retry_at is not None:
+                pending.appendleft(message)
+            else:
+                self._size -= 1
+            if pending:
+                self._schedule(chat_id, retry_at or time.monotonic())
+            else:
+                del self._chats[chat_id]
+                self._scheduled.discard(chat_id)
+            metrics.set_gauge("send_queue_depth", self._size)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        # Exponential backoff với full jitter để các worker không cùng thử lại một lúc
+        return random.uniform(0, min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2 ** attempt))
+
+    def _run(self):
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            started = time.monotonic()
+            try:
+                self.bot.send_message(chat_id=message.chat_id, text=message.text)
+                metrics.observe("send_seconds", time.monotonic() - started)
+                metrics.observe("send_delay_seconds", time.monotonic() - message.queued_at, buckets=_SEND_BUCKETS)
+                metrics.inc("send_total", status="ok")
+                self._done(message)
+            except RetryAfter as e:
+                # Telegram báo chờ bao lâu; không tính là một lần thất bại
+                metrics.inc("send_retries_total", reason="retry_after")
+                logger.warning(f"Telegram giới hạn tốc độ chat {message.chat_id}, chờ {e.retry_after}s")
+                self._done(message, retry_at=time.monotonic() + e.retry_after)
+            except (BadRequest, ChatMigrated, Unauthorized) as e:
+                # Lỗi không thể khắc phục bằng cách gửi lại (chat bị chặn, nội dung không hợp lệ...)
+                metrics.inc("send_total", status="failed")
+                logger.error(f"Không thể gửi tin nhắn tới chat {message.chat_id}: {str(e)}")
+                self._done(message)
+            except Exception as e:
+                message.attempt += 1
+                if message.attempt > self.max_retries:
+                    metrics.inc("send_total", status="failed")
+                    logger.error(f"Thất bại khi gửi tin nhắn tới chat {message.chat_id} sau {message.attempt} lần: {str(e)}")
+                    self._done(message)
+                    continue
+                delay = self._backoff(message.attempt)
+                metrics.inc("send_retries_total", reason="error")
+                logger.warning(f"Gửi tin nhắn lỗi (attempt {message.attempt}), thử lại sau {delay:.1f}s: {e}")
+                self._done(message, retry_at=time.monotonic() + delay)
+
+    def drain(self, timeout=25):
+        """Ngừng nhận tin mới, gửi hết hàng đợi rồi dừng các luồng."""
+        with self._cond:
+            if self._stopping:
+                return
+            self._stopping = True
+            logger.info(f"Đang gửi nốt {self._size} tin nhắn trước khi dừng")
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        if self._size:
+            logger.warning(f"Dừng khi còn {self._size} tin nhắn chưa gửi")
+
+
+class StreamingReply:
+    """Tin nhắn được sửa dần khi câu trả lời đang được stream.
+
+    update("") gửi tin nhắn tạm; các lần update sau sửa tin nhắn đó, không quá một lần mỗi
+    STREAM_EDIT_INTERVAL giây và bỏ qua khi hết token. finish() luôn ghi nội dung cuối cùng;
+    phần vượt quá 4096 ký tự được gửi tiếp qua outbox.
+    """
+
+    def __init__(self, bot, outbox, chat_id, interval=STREAM_EDIT_INTERVAL):
+        self.bot = bot
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message_id = None
+        self._shown = None
+        self._last_edit = 0.0
+        self._edit_after = 0.0
+
+    @property
+    def started(self):
+        return self.message_id is not None
+
+    def update(self, text):
+        if not self.started:
+            self._start()
+            return
+        now = time.monotonic()
+        if now - self._last_edit < self.interval or now < self._edit_after:
+            return
+        if not self.outbox.acquire(self.chat_id, block=False):
+            return
+        self._edit(split_message(text)[0] if text else STREAM_PLACEHOLDER)
+
+    def finish(self, text):
+        """Ghi nội dung cuối cùng; trả về False nếu chưa gửi được tin nhắn tạm (cần gửi như thường)."""
+        if not self.started:
+            return False
+        parts = split_message(text) or [STREAM_PLACEHOLDER]
+        self.outbox.acquire(self.chat_id)
+        if not self._edit(parts[0], final=True):
+            self.outbox.send(self.chat_id, parts[0])
+        for part in parts[1:]:
+            self.outbox.send(self.chat_id, part)
+        metrics.inc("stream_replies_total")
+        return True
+
+    def _start(self):
+        # Tin tạm không được vượt lên trước các câu trả lời còn trong hàng đợi của chat
+        self.outbox.wait_idle(self.chat_id, timeout=self.interval * 5)
+        self.outbox.acquire(self.chat_id)
+        try:
+            message = self.bot.send_message(chat_id=self.chat_id, text=STREAM_PLACEHOLDER)
+            self.message_id = message.message_id
+            self._shown = STREAM_PLACEHOLDER
+            self._last_edit = time.monotonic()
+        except Exception as e:
+            # Không gửi được tin tạm: câu trả lời sẽ được gửi như bình thường khi xong
+            logger.warning(f"Không thể gửi tin nhắn tạm cho chat {self.chat_id}: {str(e)}")
+
+    def _edit(self, text, final=False):
+        if text == self._shown:
+            return True
+        for attempt in range(3 if final else 1):
+            try:
+                self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id)
+                self._shown = text
+                self._last_edit = time.monotonic()
+                metrics.inc("stream_edits_total")
+                return True
+            except RetryAfter as e:
+                self._edit_after = time.monotonic() + e.retry_after
+                if not final:
+                    return False
+                time.sleep(e.retry_after)
+            except BadRequest as e:
+                # "Message is not modified" nghĩa là nội dung đã đúng
+                if "not modified" in str(e).lower():
+                    self._shown = text
+                    return True
+                logger.warning(f"Không thể sửa tin nhắn của chat {self.chat_id}: {str(e)}")
+                return False
+            except Exception as e:
+                logger.warning(f"Sửa tin nhắn lỗi (attempt {attempt + 1}) cho chat {self.chat_id}: {str(e)}")
+        return False
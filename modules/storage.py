@@ -1,21 +1,46 @@
 # storage.py
 import os
 import json
+import time
+import random
 import logging
-from google.oauth2.service_account import Credentials
-from google.cloud import firestore
-from sentence_transformers import SentenceTransformer
-import numpy as np
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from modules.embedder import EMBEDDING_MODEL, encode_one, encode_many
+from modules.index import add_to_user_index
+from utils import metrics
+from utils.tracing import span
+from utils.vectors import encode_vector, strip_vector_fields
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-# Khởi tạo mô hình nhẹ
-model = SentenceTransformer('paraphrase-MiniLM-L3-v2')
-
 _firestore_client = None
+_firestore_lock = threading.Lock()
+
+# Ghi lịch sử chat theo lô ở nền (Firestore cho phép tối đa 500 thao tác mỗi batch)
+FIRESTORE_BATCH_LIMIT = 500
+HISTORY_FLUSH_SIZE = min(int(os.getenv("HISTORY_FLUSH_SIZE", 100)), FIRESTORE_BATCH_LIMIT)
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 2.0))
+HISTORY_MAX_RETRIES = int(os.getenv("HISTORY_MAX_RETRIES", 5))
+HISTORY_BUFFER_MAX = int(os.getenv("HISTORY_BUFFER_MAX", 10000))
+
+# Kho kiến thức dùng chung lưu một bản duy nhất dưới knowledge_bases/{id}; mọi nơi nhận
+# user_id (chỉ mục, lưu/đọc trained_data) cũng nhận khóa "kb_{id}" của kho kiến thức
+KNOWLEDGE_BASE_PREFIX = "kb_"
+
+_history_buffer = deque()
+_history_cond = threading.Condition()
+_history_thread = None
+_history_stopping = False
+
+def _import_firestore():
+    global firestore
+    import google.cloud.firestore as firestore
 
 def _initialize_firestore():
+    from google.oauth2.service_account import Credentials
     try:
         logger.info("Khởi tạo Firestore credentials...")
         credentials_path = os.path.join(os.path.dirname(__file__), "../credentials.json")
@@ -39,13 +64,48 @@ def _initialize_firestore():
 def _get_firestore_client():
     global _firestore_client
     if _firestore_client is None:
-        credentials = _initialize_firestore()
-        if isinstance(credentials, firestore.Client):
-            _firestore_client = credentials
-        else:
-            _firestore_client = firestore.Client(credentials=credentials)
+        with _firestore_lock:
+            if _firestore_client is None:
+                _import_firestore()
+                credentials = _initialize_firestore()
+                if isinstance(credentials, firestore.Client):
+                    _firestore_client = credentials
+                else:
+                    _firestore_client = firestore.Client(credentials=credentials)
     return _firestore_client
 
+def is_firestore_ready():
+    return _firestore_client is not None
+
+def knowledge_base_key(kb_id):
+    return f"{KNOWLEDGE_BASE_PREFIX}{kb_id}"
+
+def owner_document(db, owner):
+    """Document users/{id} hoặc knowledge_bases/{id} (owner = "kb_<id>") chứa trained_data."""
+    owner = str(owner)
+    if owner.startswith(KNOWLEDGE_BASE_PREFIX):
+        return db.collection("knowledge_bases").document(owner[len(KNOWLEDGE_BASE_PREFIX):])
+    return db.collection("users").document(owner)
+
+def trained_data_collection(db, owner):
+    """Collection trained_data của một người dùng hoặc của kho kiến thức (owner = "kb_<id>")."""
+    return owner_document(db, owner).collection("trained_data")
+
+def touch_user_data(owner):
+    """Ghi updated_at sau khi một tiến trình khác (bulk_import, reembed) sửa trained_data,
+    để các bot đang chạy nạp lại chỉ mục (xem INDEX_REFRESH_SECONDS)."""
+    db = _get_firestore_client()
+    owner_document(db, owner).set({"updated_at": datetime.now(timezone.utc)}, merge=True)
+
+def user_data_version(owner):
+    """updated_at của người dùng hoặc kho kiến thức; None nếu chưa có hoặc đọc lỗi."""
+    try:
+        db = _get_firestore_client()
+        return owner_document(db, owner).get().get("updated_at")
+    except Exception as e:
+        logger.error(f"Lỗi khi đọc updated_at của {owner}: {str(e)}")
+        return None
+
 def save_to_firestore(user_id, data):
     try:
         user_id = str(user_id)
@@ -58,9 +118,11 @@ def save_to_firestore(user_id, data):
         
         # Tính embedding cho nội dung
         content = data.get("content", "")
+        vector = None
         if content:
-            embedding = model.encode(content, convert_to_tensor=False).tolist()
-            data["embedding"] = embedding
+            vector = encode_one(content)
+            data.update(encode_vector(vector))
+            data["embedding_model"] = EMBEDDING_MODEL
         else:
             logger.warning(f"No content to embed for user {user_id}")
             data["embedding"] = []
@@ -71,34 +133,179 @@ def save_to_firestore(user_id, data):
             "timestamp": firestore.SERVER_TIMESTAMP
         }
         logger.debug(f"Dữ liệu sẽ lưu cho user {user_id}: {data_with_timestamp}")
-        doc_ref = db.collection("users").document(user_id).collection("trained_data").add(data_with_timestamp)
+        doc_ref = trained_data_collection(db, user_id).add(data_with_timestamp)
         logger.info(f"Đã lưu dữ liệu huấn luyện cho user {user_id}, doc_id: {doc_ref[1].id}")
+
+        # Cập nhật chỉ mục trong bộ nhớ thay vì đọc lại toàn bộ trained_data
+        record = {k: v for k, v in strip_vector_fields(data).items() if k not in ("embedding_model", "timestamp")}
+        add_to_user_index(user_id, record, vector)
     except Exception as e:
         logger.error(f"Lỗi khi lưu dữ liệu user {user_id}: {str(e)}", exc_info=True)
         raise
 
-def save_to_chat_history(user_id, query, response):
+def save_many_to_firestore(user_id, records):
+    """Nhúng nhiều bản ghi trong một lần encode và ghi bằng Firestore batch (tối đa 500 mỗi lần commit)."""
     try:
         user_id = str(user_id)
+        if not user_id:
+            logger.error(f"User ID không hợp lệ: {user_id}")
+            raise ValueError("User ID không hợp lệ")
+        records = [record for record in records if isinstance(record, dict) and record.get("content")]
+        if not records:
+            logger.error(f"Không có bản ghi hợp lệ cho user {user_id}")
+            raise ValueError("Dữ liệu không hợp lệ")
+
+        vectors = encode_many([record["content"] for record in records])
+
         db = _get_firestore_client()
-        db.collection("users").document(user_id).collection("chat_history").add({
-            "user_message": query,
-            "bot_response": response,
-            "timestamp": firestore.SERVER_TIMESTAMP
-        })
-        logger.info(f"Đã lưu lịch sử chat cho user {user_id}")
+        collection = trained_data_collection(db, user_id)
+        for start in range(0, len(records), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for record, vector in zip(records[start:start + FIRESTORE_BATCH_LIMIT], vectors[start:start + FIRESTORE_BATCH_LIMIT]):
+                batch.set(collection.document(), {
+                    **record,
+                    **encode_vector(vector),
+                    "embedding_model": EMBEDDING_MODEL,
+                    "timestamp": firestore.SERVER_TIMESTAMP
+                })
+            batch.commit()
+        logger.info(f"Đã lưu {len(records)} bản ghi huấn luyện cho user {user_id}")
+
+        for record, vector in zip(records, vectors):
+            add_to_user_index(user_id, {k: v for k, v in record.items() if k != "timestamp"}, vector)
+        return len(records)
     except Exception as e:
-        logger.error(f"Lỗi khi lưu lịch sử chat user {user_id}: {str(e)}")
+        logger.error(f"Lỗi khi lưu dữ liệu user {user_id}: {str(e)}", exc_info=True)
         raise
 
+def save_to_chat_history(user_id, query, response):
+    """Đưa một dòng lịch sử chat vào bộ đệm; việc ghi Firestore diễn ra ở nền."""
+    row = (str(user_id), {
+        "user_message": query,
+        "bot_response": response,
+        "timestamp": datetime.now(timezone.utc)
+    })
+    with span("history"), _history_cond:
+        if len(_history_buffer) >= HISTORY_BUFFER_MAX:
+            _history_buffer.popleft()
+            metrics.inc("chat_history_dropped_total")
+            logger.warning("Bộ đệm lịch sử chat đầy, bỏ dòng cũ nhất")
+        _history_buffer.append(row)
+        if len(_history_buffer) >= HISTORY_FLUSH_SIZE:
+            _history_cond.notify()
+    _ensure_history_writer()
+
+def _ensure_history_writer():
+    global _history_thread
+    if _history_thread is None:
+        with _history_cond:
+            if _history_thread is None and not _history_stopping:
+                _history_thread = threading.Thread(target=_history_loop, name="history-writer", daemon=True)
+                _history_thread.start()
+
+def _take_history_batch():
+    with _history_cond:
+        count = min(len(_history_buffer), FIRESTORE_BATCH_LIMIT)
+        return [_history_buffer.popleft() for _ in range(count)]
+
+def _commit_history(rows, deadline=None):
+    """Ghi một lô lịch sử chat bằng batched write, thử lại với backoff khi lỗi.
+
+    deadline (time.monotonic()) giới hạn việc thử lại khi tắt tiến trình.
+    """
+    for attempt in range(HISTORY_MAX_RETRIES):
+        try:
+            db = _get_firestore_client()
+            batch = db.batch()
+            for user_id, row in rows:
+                doc_ref = db.collection("users").document(user_id).collection("chat_history").document()
+                batch.set(doc_ref, row)
+            batch.commit()
+            metrics.inc("chat_history_written_total", len(rows))
+            logger.debug(f"Đã lưu {len(rows)} dòng lịch sử chat")
+            return True
+        except Exception as e:
+            delay = min(30, 0.5 * 2 ** attempt) * (0.5 + random.random())
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                logger.warning(f"Lỗi khi lưu lịch sử chat (attempt {attempt+1}): {str(e)}, hết thời gian tắt")
+                break
+            logger.warning(f"Lỗi khi lưu lịch sử chat (attempt {attempt+1}): {str(e)}, thử lại sau {delay:.1f}s")
+            time.sleep(delay)
+    metrics.inc("chat_history_dropped_total", len(rows))
+    logger.error(f"Bỏ {len(rows)} dòng lịch sử chat sau {attempt+1} lần thử")
+    return False
+
+def _history_loop():
+    while True:
+        with _history_cond:
+            if not _history_stopping and len(_history_buffer) < HISTORY_FLUSH_SIZE:
+                _history_cond.wait(HISTORY_FLUSH_INTERVAL)
+            if _history_stopping:
+                return
+        rows = _take_history_batch()
+        if rows:
+            _commit_history(rows)
+
+def flush_chat_history(timeout=None):
+    """Dừng luồng ghi nền và ghi toàn bộ phần còn lại trong bộ đệm (gọi khi tắt tiến trình).
+
+    Hết `timeout` giây thì bỏ phần chưa ghi để tiến trình kịp dừng.
+    """
+    global _history_stopping
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with _history_cond:
+        _history_stopping = True
+        _history_cond.notify_all()
+    if _history_thread is not None:
+        wait = HISTORY_FLUSH_INTERVAL + 1
+        if deadline is not None:
+            wait = min(wait, max(0, deadline - time.monotonic()))
+        _history_thread.join(wait)
+    while True:
+        if deadline is not None and time.monotonic() >= deadline:
+            with _history_cond:
+                dropped = len(_history_buffer)
+                _history_buffer.clear()
+            if dropped:
+                metrics.inc("chat_history_dropped_total", dropped)
+                logger.error(f"Hết thời gian tắt, bỏ {dropped} dòng lịch sử chat chưa ghi")
+            break
+        rows = _take_history_batch()
+        if not rows:
+            break
+        _commit_history(rows, deadline)
+
+def count_user_data(user_id):
+    """Đếm số bản ghi huấn luyện bằng truy vấn aggregation (không đọc nội dung)."""
+    try:
+        user_id = str(user_id)
+        db = _get_firestore_client()
+        result = trained_data_collection(db, user_id).count().get()
+        return int(result[0][0].value)
+    except Exception as e:
+        logger.error(f"Lỗi khi đếm dữ liệu user {user_id}: {str(e)}")
+        return None
+
+def latest_user_data_timestamp(user_id):
+    """Thời điểm của bản ghi huấn luyện mới nhất (dạng chuỗi), đọc một document; None nếu không có."""
+    user_id = str(user_id)
+    db = _get_firestore_client()
+    query = trained_data_collection(db, user_id).order_by("timestamp", direction="DESCENDING").limit(1)
+    for doc in query.select(["timestamp"]).stream():
+        return str(doc.get("timestamp"))
+    return None
+
 def get_user_data(user_id):
+    """Đọc toàn bộ dữ liệu huấn luyện; lỗi Firestore được ném ra cho nơi gọi."""
     try:
         user_id = str(user_id)
         db = _get_firestore_client()
-        docs = db.collection("users").document(user_id).collection("trained_data").stream()
-        data = [doc.to_dict() for doc in docs]
-        logger.info(f"Lấy {len(data)} bản ghi từ Firestore cho user {user_id}")
+        with span("firestore.read"):
+            docs = trained_data_collection(db, user_id).stream()
+            data = [doc.to_dict() for doc in docs]
+        logger.info("Lấy %d bản ghi từ Firestore cho user %s", len(data), user_id)
         return data
     except Exception as e:
         logger.error(f"Lỗi khi lấy dữ liệu user {user_id}: {str(e)}")
-        return []
+        # Không trả về [] để chỉ mục không bị xây dựng (và cache) từ một lần đọc lỗi
+        raise
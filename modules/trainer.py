@@ -1,7 +1,9 @@
+import os
 import re
 import requests
 from bs4 import BeautifulSoup
 import logging
+from utils.chunker import chunk_text, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP
 
 def _import_firestore():
     global firestore
@@ -10,24 +12,53 @@ def _import_firestore():
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# Giới hạn tải trang khi huấn luyện từ URL
+TRAIN_URL_MAX_BYTES = int(os.getenv("TRAIN_URL_MAX_BYTES", 2 * 1024 * 1024))
+TRAIN_URL_MAX_CHUNKS = int(os.getenv("TRAIN_URL_MAX_CHUNKS", 200))
+
+# "/train text=...", "/train text ...", "/train url=..." hoặc "train url ..." (không phân biệt hoa thường)
+_TRAIN_COMMAND = re.compile(r"^/?train\s+(text|url)(?:\s*=\s*|\s+|$)(.*)$", re.IGNORECASE | re.DOTALL)
+
+try:
+    import lxml  # noqa: F401
+    _HTML_PARSER = "lxml"
+except ImportError:
+    _HTML_PARSER = "html.parser"
+
+def _download_page(url):
+    """Tải trang theo luồng, dừng khi vượt TRAIN_URL_MAX_BYTES. Trả về (status, html, bị cắt)."""
+    with requests.get(url, timeout=(5, 10), stream=True) as response:
+        if response.status_code != 200:
+            return response.status_code, None, False
+        chunks, size, truncated = [], 0, False
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= TRAIN_URL_MAX_BYTES:
+                truncated = True
+                break
+        raw = b"".join(chunks)[:TRAIN_URL_MAX_BYTES]
+        encoding = response.encoding or "utf-8"
+        return response.status_code, raw.decode(encoding, errors="replace"), truncated
+
 def handle_train(user_id, command):
-    """Xử lý lệnh /train để lưu dữ liệu huấn luyện."""
-    logger.info(f"Processing /train command for user {user_id}: {command}")
+    """Xử lý lệnh /train để lưu dữ liệu huấn luyện.
+
+    `command` là tin nhắn gốc (chưa qua clean_input, để giữ nguyên URL); nội dung văn bản
+    được làm sạch tại đây.
+    """
+    logger.info(f"Processing /train command for user {user_id}: {command[:100]}")
     _import_firestore()
     
     command = command.strip()
     if not command.startswith("/"):
         command = "/" + command
+    match = _TRAIN_COMMAND.match(command)
+    kind, argument = (match.group(1).lower(), match.group(2).strip()) if match else (None, None)
     
     try:
-        if "text=" in command:
-            content = command.split("text=", 1)[1].strip()
-        elif command.startswith("/train text "):
-            content = command[len("/train text "):].strip()
-        else:
-            content = None
-        
-        if content:
+        if kind == "text":
+            content = argument
             if not content:
                 logger.warning(f"Empty content for /train text from user {user_id}")
                 return "Vui lòng cung cấp nội dung văn bản."
@@ -48,37 +79,37 @@ def handle_train(user_id, command):
             logger.info(f"Saved text training data for user {user_id}: {cleaned_content[:50]}...")
             return f"Dữ liệu văn bản đã được lưu: {cleaned_content[:50]}..."
 
-        elif "url=" in command:
-            url = command.split("url=", 1)[1].strip()
+        elif kind == "url":
+            url = argument
             if not re.match(r"https?://", url):
                 logger.warning(f"Invalid URL from user {user_id}: {url}")
                 return "URL không hợp lệ, vui lòng bắt đầu bằng http:// hoặc https://."
             try:
-                response = requests.get(url, timeout=10)
-                if response.status_code != 200:
-                    logger.error(f"Failed to access URL for user {user_id}: {url}, status {response.status_code}")
+                status, html, truncated = _download_page(url)
+                if html is None:
+                    logger.error(f"Failed to access URL for user {user_id}: {url}, status {status}")
                     return f"Không thể truy cập URL: {url}"
-                soup = BeautifulSoup(response.text, "html.parser")
+                if truncated:
+                    logger.warning(f"URL content truncated at {TRAIN_URL_MAX_BYTES} bytes for user {user_id}: {url}")
+                soup = BeautifulSoup(html, _HTML_PARSER)
                 for tag in soup(["script", "style", "header", "footer", "nav"]):
                     tag.decompose()
-                content = soup.get_text(separator=" ", strip=True)
-                cleaned_content = clean_input(content)
+                # Làm sạch từng đoạn văn bản của trang thay vì ghép thành một chuỗi lớn rồi mới xử lý
+                cleaned_content = "".join(clean_stream(text + " " for text in soup.stripped_strings))
                 if not isinstance(cleaned_content, str) or not cleaned_content:
                     logger.error(f"Dữ liệu không hợp lệ cho user {user_id}: {cleaned_content}")
                     return "Nội dung không hợp lệ."
-                if len(cleaned_content) > 5000:
-                    logger.warning(f"URL content too long for user {user_id}: {len(cleaned_content)} chars")
-                    return "Nội dung URL quá dài, tối đa 5000 ký tự."
-                data = {
-                    "content": cleaned_content,
+                chunks = chunk_text(cleaned_content, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP)[:TRAIN_URL_MAX_CHUNKS]
+                records = [{
+                    "content": chunk,
                     "type": "url",
                     "source": url,
-                    "timestamp": firestore.SERVER_TIMESTAMP
-                }
-                logger.debug(f"Chuẩn bị lưu dữ liệu cho user {user_id}: {data}")
-                save_to_firestore(user_id, data)
-                logger.info(f"Saved URL training data for user {user_id}: {url}")
-                return f"Dữ liệu từ {url} đã được lưu."
+                    "chunk": i
+                } for i, chunk in enumerate(chunks)]
+                logger.debug(f"Chuẩn bị lưu {len(records)} đoạn cho user {user_id} từ {url}")
+                save_many_to_firestore(user_id, records)
+                logger.info(f"Saved URL training data for user {user_id}: {url} ({len(records)} chunks)")
+                return f"Dữ liệu từ {url} đã được lưu ({len(records)} đoạn)."
             except requests.RequestException as e:
                 logger.error(f"URL request error for user {user_id}: {str(e)}")
                 return f"Lỗi khi truy cập URL: {str(e)}"
@@ -95,6 +126,14 @@ def save_to_firestore(user_id, data):
     from modules.storage import save_to_firestore
     save_to_firestore(user_id, data)
 
+def save_many_to_firestore(user_id, records):
+    from modules.storage import save_many_to_firestore
+    return save_many_to_firestore(user_id, records)
+
 def clean_input(text):
     from utils.cleaner import clean_input
     return clean_input(text)
+
+def clean_stream(chunks):
+    from utils.cleaner import clean_stream
+    return clean_stream(chunks)
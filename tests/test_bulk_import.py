@@ -0,0 +1,18 @@
+# Đường dẫn: cotienbot/tests/test_bulk_import.py
+# Tên file: test_bulk_import.py
+"""File .json được đọc nguyên file như một mảng JSON, không phải JSON Lines."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.bulk_import import parse_training_file  # noqa: E402
+
+
+def test_json_array():
+    assert parse_training_file("a.json", b'[{"content":"x"}]') == ["x"]
+
+
+def test_json_array_multiline():
+    raw = b'[\n  {"content": "x"},\n  {"content": "y"}\n]\n'
+    assert parse_training_file("a.json", raw) == ["x", "y"]
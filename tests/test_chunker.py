@@ -0,0 +1,22 @@
+# Đường dẫn: cotienbot/tests/test_chunker.py
+# Tên file: test_chunker.py
+"""chunk_text từ chối overlap không nhỏ hơn một nửa size (vòng lặp sẽ không tiến)."""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.chunker import chunk_text, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP  # noqa: E402
+
+
+@pytest.mark.parametrize("size, overlap", [(100, 50), (100, 80), (10, 10)])
+def test_rejects_large_overlap(size, overlap):
+    with pytest.raises(ValueError):
+        chunk_text("a " * 500, size, overlap)
+
+
+def test_training_settings_are_valid():
+    assert TRAIN_CHUNK_OVERLAP * 2 < TRAIN_CHUNK_CHARS
+    chunks = chunk_text("câu văn. " * 500, TRAIN_CHUNK_CHARS, TRAIN_CHUNK_OVERLAP)
+    assert chunks and all(len(chunk) <= TRAIN_CHUNK_CHARS for chunk in chunks)
@@ -0,0 +1,81 @@
+# Đường dẫn: cotienbot/tests/test_commands.py
+# Tên file: test_commands.py
+"""Các lệnh gửi qua process_update phải khớp dù clean_input bỏ ký tự "/"."""
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:test")
+
+import main  # noqa: E402
+
+
+def _update(text):
+    message = types.SimpleNamespace(chat_id=42, message_id=1, text=text, document=None)
+    return types.SimpleNamespace(message=message)
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main, "send_reply", lambda chat_id, text: sent.append((chat_id, text)))
+    monkeypatch.setattr(main, "check_authentication", lambda chat_id: True)
+    return sent
+
+
+def test_subscribe_command(monkeypatch, replies):
+    calls = []
+
+    def fake_subscribe(chat_id, kb_id):
+        calls.append((chat_id, kb_id))
+        return True, f"Đã đăng ký kho kiến thức {kb_id}."
+
+    monkeypatch.setattr(main, "subscribe", fake_subscribe)
+    main.process_update(_update("/subscribe x"))
+    assert calls == [(42, "x")]
+    assert replies == [(42, "Đã đăng ký kho kiến thức x.")]
+
+
+def test_unsubscribe_and_kb_commands(monkeypatch, replies):
+    monkeypatch.setattr(main, "unsubscribe", lambda chat_id, kb_id: (True, f"bỏ {kb_id}"))
+    monkeypatch.setattr(main, "get_subscriptions", lambda chat_id: ("a", "b"))
+    main.process_update(_update("/unsubscribe a"))
+    main.process_update(_update("/kb"))
+    assert replies == [(42, "bỏ a"), (42, "Kho kiến thức đã đăng ký: a, b")]
+
+
+def test_plain_text_is_not_a_command(monkeypatch, replies):
+    monkeypatch.setattr(main, "subscribe", lambda *args: pytest.fail("không phải lệnh"))
+    monkeypatch.setattr(main._ready, "wait", lambda timeout=None: False)
+    main.process_update(_update("subscribe x"))
+    assert replies == [(42, main.WARMING_UP_RESPONSE)]
+
+
+@pytest.fixture
+def training(monkeypatch, replies):
+    from modules import trainer
+    calls = {"urls": [], "texts": []}
+    monkeypatch.setattr(main._ready, "wait", lambda timeout=None: True)
+    monkeypatch.setattr(trainer, "_import_firestore", lambda: setattr(trainer, "firestore", types.SimpleNamespace(SERVER_TIMESTAMP=None)))
+    monkeypatch.setattr(trainer, "_download_page", lambda url: (calls["urls"].append(url), (404, None, False))[1])
+    monkeypatch.setattr(trainer, "save_to_firestore", lambda user_id, data: calls["texts"].append(data["content"]))
+    return calls
+
+
+@pytest.mark.parametrize("text", [
+    "/train url=https://example.com/article?id=1",
+    "/train url https://example.com/article?id=1",
+    "Train URL = https://example.com/article?id=1",
+])
+def test_train_url_keeps_url_intact(training, text):
+    main.process_update(_update(text))
+    assert training["urls"] == ["https://example.com/article?id=1"]
+
+
+@pytest.mark.parametrize("text", ["/train text=Tôi tên Vinh!", "/train text Tôi tên Vinh!"])
+def test_train_text_is_cleaned(training, replies, text):
+    main.process_update(_update(text))
+    assert training["texts"] == ["tôi tên vinh!"]
+    assert replies[0][1].startswith("Dữ liệu văn bản đã được lưu")
@@ -0,0 +1,26 @@
+# Đường dẫn: cotienbot/tests/test_dispatcher.py
+# Tên file: test_dispatcher.py
+"""WorkerPool.drain phải trả về trong thời hạn kể cả khi hàng đợi đầy và worker bị kẹt."""
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.dispatcher import WorkerPool  # noqa: E402
+
+
+def test_drain_full_queue_respects_timeout():
+    release = threading.Event()
+    pool = WorkerPool(lambda item: release.wait(), workers=1, queue_size=2, name="test")
+    try:
+        assert pool.submit("k", 1)
+        time.sleep(0.05)  # worker lấy việc đầu tiên và bị chặn
+        assert pool.submit("k", 2) and pool.submit("k", 3)
+        started = time.monotonic()
+        pool.drain(timeout=0.3)
+        assert time.monotonic() - started < 1.0
+        assert not pool.submit("k", 4)
+    finally:
+        release.set()
@@ -0,0 +1,17 @@
+# Đường dẫn: cotienbot/tests/test_response_cache.py
+# Tên file: test_response_cache.py
+"""SemanticCache với capacity = 0 (RESPONSE_CACHE_SIZE=0) là cache tắt, không được lỗi."""
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.response_cache import SemanticCache  # noqa: E402
+
+
+def test_zero_capacity_is_noop():
+    cache = SemanticCache(0, 0.9, 60)
+    vector = np.ones(4, dtype=np.float32)
+    cache.put("42", vector, "trả lời")
+    assert cache.get("42", vector) is None
@@ -0,0 +1,48 @@
+# Đường dẫn: cotienbot/utils/chunker.py
+# Tên file: chunker.py
+
+import os
+
+# Cách chia đoạn khi huấn luyện (dùng chung cho /train url= và nhập file)
+TRAIN_CHUNK_CHARS = int(os.getenv("TRAIN_CHUNK_CHARS", 1000))
+# Tối đa dưới một nửa độ dài đoạn (xem chunk_text)
+TRAIN_CHUNK_OVERLAP = min(int(os.getenv("TRAIN_CHUNK_OVERLAP", 150)), (TRAIN_CHUNK_CHARS - 1) // 2)
+
+
+def chunk_text(text, size=1000, overlap=150):
+    """Chia văn bản thành các đoạn dài tối đa `size` ký tự, chồng lấn `overlap` ký tự.
+
+    Ưu tiên cắt ở cuối câu hoặc khoảng trắng gần giới hạn để không cắt đôi từ. Điểm cắt có thể
+    lùi về giữa đoạn nên overlap phải nhỏ hơn size / 2, nếu không đoạn sau có thể bắt đầu
+    trước đoạn trước và sinh ra O(n) đoạn gần như trùng nhau.
+    """
+    if not text:
+        return []
+    if overlap * 2 >= size:
+        raise ValueError("overlap phải nhỏ hơn một nửa size")
+
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + size, length)
+        if end < length:
+            window_start = start + size // 2
+            cut = max(text.rfind(". ", window_start, end), text.rfind("? ", window_start, end), text.rfind("! ", window_start, end))
+            if cut != -1:
+                end = cut + 1
+            else:
+                space = text.rfind(" ", window_start, end)
+                if space != -1:
+                    end = space
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        next_start = end - overlap
+        # Bắt đầu đoạn kế tiếp ở đầu một từ
+        space = text.find(" ", next_start, end)
+        next_start = space + 1 if space != -1 else next_start
+        start = max(next_start, start + 1)
+    return chunks
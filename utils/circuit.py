@@ -0,0 +1,47 @@
+# Đường dẫn: cotienbot/utils/circuit.py
+# Tên file: circuit.py
+
+import time
+import threading
+
+
+class CircuitBreaker:
+    """Ngắt mạch: sau nhiều lỗi liên tiếp thì từ chối gọi ngay, thử lại sau reset_timeout giây."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """Cho phép gọi khi mạch đóng, hoặc một lần thử khi đã hết thời gian chờ."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                # Half-open: cho một lần thử, các lần khác chờ thêm một chu kỳ
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
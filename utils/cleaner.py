@@ -2,17 +2,62 @@
 # Tên file: cleaner.py
 
 import re
+import unicodedata
+
+# Biên dịch sẵn; "+" để xóa cả cụm ký tự đặc biệt/emoji trong một lần thay thế
+_DISALLOWED = re.compile(r"[^\w\s.,!?]+")
+
+
+class CleanText(str):
+    """Chuỗi đã qua clean_input; truyền lại vào clean_input sẽ được trả về ngay."""
+    __slots__ = ()
+
+
+def _normalize(text):
+    # NFC để chữ có dấu tiếng Việt (dựng sẵn hay tổ hợp) so sánh được với nhau;
+    # nếu không, dấu tổ hợp không thuộc \w và bị xóa mất
+    if not text.isascii() and not unicodedata.is_normalized("NFC", text):
+        text = unicodedata.normalize("NFC", text)
+    # split()/join gộp khoảng trắng và cắt hai đầu trong một lượt
+    return " ".join(_DISALLOWED.sub("", text).split()).lower()
+
 
 def clean_input(text):
     """Làm sạch văn bản đầu vào."""
     if not text:
-        return ""
-    
-    # Loại bỏ ký tự đặc biệt, emoji, khoảng trắng dư
-    text = re.sub(r"[^\w\s.,!?]", "", text)
-    text = re.sub(r"\s+", " ", text).strip()
-    
-    # Chuẩn hóa chữ thường (tùy chọn, có thể bỏ nếu cần giữ nguyên)
-    text = text.lower()
-    
-    return text
+        return CleanText("")
+    if isinstance(text, CleanText):
+        return text
+
+    # Loại bỏ ký tự đặc biệt, emoji, khoảng trắng dư và chuẩn hóa chữ thường
+    return CleanText(_normalize(text))
+
+
+def clean_stream(chunks):
+    """Làm sạch văn bản lớn theo từng phần; ghép các phần trả về sẽ bằng clean_input(toàn bộ).
+
+    Mỗi phần chỉ được xử lý đến khoảng trắng cuối cùng; phần đuôi được ghép vào phần sau
+    để không cắt đôi một từ (hay một chữ và dấu tổ hợp của nó).
+    """
+    started = False
+    for segment in _split_at_spaces(chunks):
+        cleaned = _normalize(segment)
+        if cleaned:
+            yield " " + cleaned if started else cleaned
+            started = True
+
+
+def _split_at_spaces(chunks):
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk if carry else chunk
+        cut = len(text)
+        while cut and not text[cut - 1].isspace():
+            cut -= 1
+        if not cut:
+            carry = text
+            continue
+        carry = text[cut:]
+        yield text[:cut]
+    if carry:
+        yield carry
@@ -0,0 +1,87 @@
+# Đường dẫn: cotienbot/utils/metrics.py
+# Tên file: metrics.py
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+
+# Ngưỡng (giây) mặc định cho histogram độ trễ
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Tăng bộ đếm."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Ghi giá trị hiện tại của một gauge."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Ghi một giá trị vào histogram (đếm tích lũy theo ngưỡng như Prometheus)."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(histogram["buckets"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def snapshot():
+    """Trả về bản sao các chỉ số hiện tại."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "histograms": {key: {**h, "counts": list(h["counts"])} for key, h in _histograms.items()},
+        }
+
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render_prometheus():
+    """Xuất các chỉ số theo định dạng văn bản của Prometheus (cho endpoint /metrics)."""
+    data = snapshot()
+    lines = []
+    for kind, series in (("counter", data["counters"]), ("gauge", data["gauges"])):
+        typed = set()
+        for (name, labels), value in sorted(series.items(), key=lambda item: str(item[0])):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+    typed = set()
+    for (name, labels), histogram in sorted(data["histograms"].items(), key=lambda item: str(item[0])):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        # counts đã là số đếm tích lũy theo từng ngưỡng
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+# Đường dẫn: cotienbot/utils/tracing.py
+# Tên file: tracing.py
+
+import os
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tỉ lệ update được ghi log chi tiết từng giai đoạn; update chậm hơn TRACE_SLOW_SECONDS luôn được ghi
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", 2.0))
+# Tỉ lệ ghi các dòng log trên đường xử lý mỗi tin nhắn (xem sampled())
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+
+_local = threading.local()
+_listeners = []
+
+
+class Trace:
+    """Thời gian các giai đoạn xử lý một update; có thể chuyển từ luồng webhook sang worker."""
+
+    __slots__ = ("trace_id", "started", "spans")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.spans = []  # (giai đoạn, giây)
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+        metrics.observe("stage_seconds", seconds, stage=stage)
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+def start_trace(trace_id):
+    """Bắt đầu trace cho update hiện tại trên luồng này."""
+    trace = _local.trace = Trace(trace_id)
+    return trace
+
+
+def detach_trace():
+    """Gỡ trace khỏi luồng hiện tại (trước khi chuyển update sang luồng khác)."""
+    trace = current_trace()
+    _local.trace = None
+    return trace
+
+
+def resume_trace(trace):
+    _local.trace = trace
+
+
+@contextmanager
+def span(stage):
+    """Đo thời gian một giai đoạn: ghi vào histogram stage_seconds và vào trace hiện tại nếu có."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        trace = current_trace()
+        if trace is not None:
+            trace.add(stage, elapsed)
+        else:
+            metrics.observe("stage_seconds", elapsed, stage=stage)
+
+
+def finish_trace(outcome="ok"):
+    """Kết thúc trace trên luồng hiện tại; ghi một dòng log key=value nếu chậm hoặc được lấy mẫu."""
+    trace = detach_trace()
+    if trace is None:
+        return
+    total = time.perf_counter() - trace.started
+    metrics.observe("update_seconds", total, outcome=outcome)
+    for listener in _listeners:
+        listener(trace, outcome, total)
+    if total >= TRACE_SLOW_SECONDS or random.random() < TRACE_SAMPLE_RATE:
+        stages = " ".join(f"{stage}_ms={seconds * 1000:.1f}" for stage, seconds in trace.spans)
+        level = logging.WARNING if total >= TRACE_SLOW_SECONDS else logging.INFO
+        logger.log(level, "trace id=%s outcome=%s total_ms=%.1f %s", trace.trace_id, outcome, total * 1000, stages)
+
+
+def add_trace_listener(listener):
+    """Đăng ký hàm listener(trace, outcome, total_seconds) được gọi khi mỗi update kết thúc."""
+    _listeners.append(listener)
+
+
+def sampled(rate=None):
+    """True cho khoảng `rate` (mặc định LOG_SAMPLE_RATE) số lần gọi; dùng để thưa bớt log trên đường nóng."""
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or random.random() < rate
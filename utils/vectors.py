@@ -0,0 +1,56 @@
+# Đường dẫn: cotienbot/utils/vectors.py
+# Tên file: vectors.py
+
+import os
+import numpy as np
+
+# Định dạng lưu embedding trong Firestore: "f16", "i8" hoặc "f32"
+EMBEDDING_FORMAT = os.getenv("EMBEDDING_FORMAT", "f16")
+EMBEDDING_VERSION = 2
+
+_DTYPES = {"f32": np.float32, "f16": np.float16, "i8": np.int8}
+
+VECTOR_FIELDS = ("embedding", "embedding_bytes", "embedding_format", "embedding_scale", "embedding_version")
+
+
+def encode_vector(vector, fmt=None):
+    """Mã hóa embedding thành một trường bytes gọn (phiên bản 2)."""
+    fmt = fmt or EMBEDDING_FORMAT
+    if fmt not in _DTYPES:
+        raise ValueError(f"Định dạng embedding không hỗ trợ: {fmt}")
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    fields = {"embedding_version": EMBEDDING_VERSION, "embedding_format": fmt}
+    if fmt == "i8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127.0 if peak else 1.0
+        fields["embedding_scale"] = scale
+        encoded = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    else:
+        encoded = vector.astype(_DTYPES[fmt])
+    fields["embedding_bytes"] = encoded.astype(encoded.dtype.newbyteorder("<"), copy=False).tobytes()
+    return fields
+
+
+def decode_vector(record):
+    """Đọc embedding từ bản ghi, hỗ trợ cả dạng bytes mới và dạng danh sách số cũ.
+
+    Với float16/int8 trả về view trên bytes (không sao chép); bên gọi tự đổi sang float32
+    khi đưa vào ma trận chỉ mục. Trả về None nếu bản ghi không có embedding.
+    """
+    raw = record.get("embedding_bytes")
+    if raw:
+        fmt = record.get("embedding_format", "f32")
+        vector = np.frombuffer(raw, dtype=np.dtype(_DTYPES[fmt]).newbyteorder("<"))
+        if fmt == "i8":
+            # Cosine similarity không phụ thuộc độ lớn, nhưng vẫn khôi phục thang đo gốc
+            return vector.astype(np.float32) * np.float32(record.get("embedding_scale", 1.0))
+        return vector
+    legacy = record.get("embedding")
+    if legacy:
+        return np.asarray(legacy, dtype=np.float32)
+    return None
+
+
+def strip_vector_fields(record):
+    """Bỏ các trường embedding khỏi bản ghi (giữ lại nội dung và metadata)."""
+    return {k: v for k, v in record.items() if k not in VECTOR_FIELDS}